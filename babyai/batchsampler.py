@@ -18,7 +18,7 @@ class BatchSampler(object):
 
         self.total_demos = 0
         self.num_used_demos = 0
-        self.current_demos = [None] * self.num_task
+        self.current_perms = [None] * self.num_task
         self.current_ids = [None] * self.num_task
         for tid in range(self.num_task):
             self.total_demos += self.reset(tid)
@@ -29,8 +29,8 @@ class BatchSampler(object):
         self.dist_task = dist_task
 
     def reset(self, tid):
-        np.random.shuffle(self.demos[tid])
-        self.current_demos[tid] = self.demos[tid]
+        # Shuffle the indices rather than the demos, which may be a lazily read DemoStore
+        self.current_perms[tid] = np.random.permutation(len(self.demos[tid]))
         self.current_ids[tid] = 0
 
         return len(self.demos[tid])
@@ -41,11 +41,11 @@ class BatchSampler(object):
         for i in range(self.batch_size):
             tid = self.rng.choice(range(len(self.dist_task)), p=self.dist_task)
             cid = self.current_ids[tid]
-            if cid >= len(self.current_demos[tid]):
+            if cid >= len(self.current_perms[tid]):
                 self.reset(tid)
                 cid = self.current_ids[tid]
 
-            batch += [self.current_demos[tid][cid]]
+            batch += [self.demos[tid][self.current_perms[tid][cid]]]
             self.current_ids[tid] += 1
 
         if self.no_mem:
@@ -1,3 +1,5 @@
+from collections import deque
+
 from gym_minigrid.minigrid import *
 from babyai.levels.verifier import *
 from babyai.levels.verifier import (ObjDesc, pos_next_to,
@@ -367,6 +369,7 @@ class GoNextToSubgoal(Subgoal):
         # -> try to find a non-blocker path
         path, _, _ = self.bot._shortest_path(
             lambda pos, cell: pos == target_pos,
+            key=('pos', tuple(target_pos))
         )
 
         # No non-blocker path found, and reexploration is allowed
@@ -376,7 +379,7 @@ class GoNextToSubgoal(Subgoal):
             # by a shortest path within the current room, go for it.
             current_room = self.bot.mission.room_from_pos(*self.pos)
             path, unseen_pos, _ = self.bot._shortest_path(
-                lambda pos, cell: not self.bot.vis_mask[pos])
+                lambda pos, cell: not self.bot.vis_mask[pos], key='unseen')
             if unseen_pos is not None and all([current_room.pos_inside(*pos) for pos in path]):
                 self.bot.stack.append(
                     GoNextToSubgoal(self.bot, unseen_pos, reason='ReexploreRoom'))
@@ -388,7 +391,8 @@ class GoNextToSubgoal(Subgoal):
         if not path:
             path, _, _ = self.bot._shortest_path(
                 lambda pos, cell: pos == target_pos,
-                try_with_blockers=True
+                try_with_blockers=True,
+                key=('pos', tuple(target_pos))
             )
 
         # No path found
@@ -474,7 +478,8 @@ class ExploreSubgoal(Subgoal):
         # Find the closest unseen position
         _, unseen_pos, with_blockers = self.bot._shortest_path(
             lambda pos, cell: not self.bot.vis_mask[pos],
-            try_with_blockers=True
+            try_with_blockers=True,
+            key='unseen'
         )
 
         if unseen_pos:
@@ -494,11 +499,11 @@ class ExploreSubgoal(Subgoal):
         # a subgoal may try to open the same door for exploration,
         # resulting in an infinite loop.
         _, door_pos, _ = self.bot._shortest_path(
-            unopened_unlocked_door, try_with_blockers=True)
+            unopened_unlocked_door, try_with_blockers=True, key='unopened_unlocked_door')
         if not door_pos:
             # Try to find a locker door if an unlocked one is not available.
             _, door_pos, _ = self.bot._shortest_path(
-            unopened_door, try_with_blockers=True)
+            unopened_door, try_with_blockers=True, key='unopened_door')
 
         # Open the door
         if door_pos:
@@ -520,6 +525,121 @@ class ExploreSubgoal(Subgoal):
         return True
 
 
+class DistanceField:
+    """The number of actions needed to face any of the target positions,
+    from every pose (position and direction) of the agent.
+
+    The field is computed once over the grid, after which the distance and
+    the optimal action from any pose are read off in constant time, without
+    stepping a `Bot` through the episode. The agent can walk over the cells
+    it can overlap, and open the closed doors, which costs one more action.
+    Locked doors and the other objects are not moved out of the way. If a
+    `known` mask is given, the other cells are not walked over either.
+
+    The field is recomputed when the grid, or the known mask, changes.
+
+    Parameters:
+    ----------
+    grid : ArrayGrid
+        The grid of the level.
+    targets : list of (int, int) tuples
+        The positions to go next to.
+    known : boolean array, optional
+        The cells known to the agent, e.g. the visibility mask of a `Bot`.
+
+    """
+
+    def __init__(self, grid, targets, known=None):
+        self.grid = grid
+        self.targets = [(int(i), int(j)) for i, j in targets]
+        self.known = known
+        self.key = None
+
+    def distance(self, pos, dir):
+        """Number of actions needed to face a target from a pose,
+        or None if no target can be reached."""
+
+        self._update()
+        distance = self.distances[self._pose(int(pos[0]), int(pos[1]), dir)]
+        return distance if distance >= 0 else None
+
+    def action(self, pos, dir):
+        """Optimal action from a pose, or None if a target is already
+        faced or no target can be reached."""
+
+        self._update()
+        actions = MiniGridEnv.Actions
+        i, j = int(pos[0]), int(pos[1])
+        distance = self.distances[self._pose(i, j, dir)]
+        if distance <= 0:
+            return None
+
+        # Going straight is preferred over turning
+        di, dj = DIR_TO_VEC[dir]
+        cost = self.costs[(i + di) * self.grid.height + j + dj]
+        fwd_distance = self.distances[self._pose(i + di, j + dj, dir)]
+        if cost and fwd_distance >= 0 and fwd_distance + cost == distance:
+            return actions.toggle if cost == 2 else actions.forward
+        if self.distances[self._pose(i, j, (dir - 1) % 4)] + 1 == distance:
+            return actions.left
+        return actions.right
+
+    def _pose(self, i, j, dir):
+        return (i * self.grid.height + j) * 4 + dir
+
+    def _update(self):
+        key = (self.grid.version,
+               None if self.known is None else np.count_nonzero(self.known))
+        if key != self.key:
+            self.key = key
+            self._compute()
+
+    def _compute(self):
+        width, height = self.grid.width, self.grid.height
+        encoding = self.grid.encoding
+
+        # Number of actions needed to step into every cell,
+        # 0 for the cells which can't be walked over
+        costs = self.grid.can_overlap.astype(int)
+        costs[(encoding[:, :, 0] == OBJECT_TO_IDX['door'])
+              & (encoding[:, :, 2] == STATE_TO_IDX['closed'])] = 2
+        if self.known is not None:
+            costs[~self.known] = 0
+        self.costs = costs = costs.ravel().tolist()
+
+        # Search backwards from the poses facing a target. As the actions
+        # cost 1 or 2, there is one queue for every distance.
+        self.distances = distances = [-1] * (width * height * 4)
+        queues = [deque(), deque(), deque()]
+        for i, j in self.targets:
+            for dir in range(4):
+                di, dj = DIR_TO_VEC[dir]
+                if 0 <= i - di < width and 0 <= j - dj < height and costs[(i - di) * height + j - dj]:
+                    queues[0].append((i - di, j - dj, dir))
+
+        distance = 0
+        while any(queues):
+            queue = queues[0]
+            while queue:
+                i, j, dir = queue.popleft()
+                pose = ((i * height) + j) * 4 + dir
+                if distances[pose] >= 0:
+                    continue
+                distances[pose] = distance
+
+                # Turning left from the next direction, or right from the previous one
+                queues[1].append((i, j, (dir + 1) % 4))
+                queues[1].append((i, j, (dir - 1) % 4))
+                # Stepping forward, or opening a closed door and stepping forward
+                di, dj = DIR_TO_VEC[dir]
+                cost = costs[i * height + j]
+                if costs[(i - di) * height + j - dj]:
+                    queues[cost].append((i - di, j - dj, dir))
+
+            queues.append(queues.pop(0))
+            distance += 1
+
+
 class Bot:
     """A bot that can solve all BabyAI levels.
 
@@ -541,6 +661,10 @@ class Bot:
 
     """
 
+    # Errors raised by the bot when it can not solve the mission, either
+    # because the instructions are not supported or because a box was opened
+    expected_errors = (AssertionError, DisappearedBoxError)
+
     def __init__(self, mission):
         # Mission to be solved
         self.mission = mission
@@ -564,6 +688,14 @@ class Bot:
         # performed by this bot
         self.bfs_step_counter = 0
 
+        # Results of the searches, kept until the known map changes
+        # (see `_process_obs` and `_cached_search`)
+        self.search_cache = {}
+        self.map_key = None
+
+        # Distance fields of the GoNextTo subgoals, by target positions
+        self.distance_fields = {}
+
     def replan(self, action_taken=None):
         """Replan and suggest an action.
 
@@ -616,15 +748,54 @@ class Bot:
 
         return suggested_action
 
+    def goal_distance_field(self):
+        """Distance field (see `DistanceField`) over the known grid for the
+        GoNextTo subgoal on top of the stack, or None if there is no such
+        subgoal or it is about putting an object next to another one.
+        An object description targets all the matching visible objects.
+
+        The field is kept, and only recomputed when the grid or the known
+        cells change, so that the optimal action can be queried for many
+        poses of the agent.
+
+        """
+
+        if not self.stack:
+            return None
+        subgoal = self.stack[-1]
+        if not isinstance(subgoal, GoNextToSubgoal) or subgoal.reason == 'PutNext':
+            return None
+
+        if isinstance(subgoal.datum, ObjDesc):
+            targets = [obj_pos for obj, obj_pos in zip(subgoal.datum.obj_set, subgoal.datum.obj_poss)
+                       if obj != self.mission.carrying and self.vis_mask[obj_pos]]
+        elif isinstance(subgoal.datum, WorldObj):
+            targets = [subgoal.datum.cur_pos]
+        else:
+            targets = [subgoal.datum]
+        targets = tuple((int(i), int(j)) for i, j in targets)
+        if not targets:
+            return None
+
+        if targets not in self.distance_fields:
+            self.distance_fields[targets] = DistanceField(self.mission.grid, targets, self.vis_mask)
+        return self.distance_fields[targets]
+
     def _find_obj_pos(self, obj_desc, adjacent=False):
         """Find the position of the closest visible object matching a given description."""
 
         assert len(obj_desc.obj_set) > 0
 
+        cached = self._cached_search(('obj', obj_desc, adjacent))
+        if cached is not None:
+            return cached[1]
+
         best_distance_to_obj = 999
         best_pos = None
         best_obj = None
+        best_path = None
 
+        candidates = []
         for i in range(len(obj_desc.obj_set)):
             try:
                 if obj_desc.obj_set[i] == self.mission.carrying:
@@ -632,78 +803,108 @@ class Bot:
                 obj_pos = obj_desc.obj_poss[i]
 
                 if self.vis_mask[obj_pos]:
-                    shortest_path_to_obj, _, with_blockers = self._shortest_path(
-                        lambda pos, cell: pos == obj_pos,
-                        try_with_blockers=True
-                    )
-                    assert shortest_path_to_obj is not None
-                    distance_to_obj = len(shortest_path_to_obj)
-
-                    if with_blockers:
-                        # The distance should take into account the steps necessary
-                        # to unblock the way. Instead of computing it exactly,
-                        # we can use a lower bound on this number of steps
-                        # which is 4 when the agent is not holding anything
-                        # (pick, turn, drop, turn back
-                        # and 7 if the agent is carrying something
-                        # (turn, drop, turn back, pick,
-                        # turn to other direction, drop, turn back)
-                        distance_to_obj = (len(shortest_path_to_obj)
-                                           + (7 if self.mission.carrying else 4))
-
-                    # If we looking for a door and we are currently in that cell
-                    # that contains the door, it will take us at least 2
-                    # (3 if `adjacent == True`) steps to reach the goal.`
-                    if distance_to_obj == 0:
-                        distance_to_obj = 3 if adjacent else 2
-
-                    # If what we want is to face a location that is adjacent to an object,
-                    # and if we are already right next to this object,
-                    # then we should not prefer this object to those at distance 2
-                    if adjacent and distance_to_obj == 1:
-                        distance_to_obj = 3
-
-                    if distance_to_obj < best_distance_to_obj:
-                        best_distance_to_obj = distance_to_obj
-                        best_pos = obj_pos
-                        best_obj = obj_desc.obj_set[i]
+                    candidates.append((obj_desc.obj_set[i], obj_pos))
             except IndexError:
                 # Suppose we are tracking red keys, and we just used a red key to open a door,
                 # then for the last i, accessing obj_desc.obj_poss[i] will raise an IndexError
                 # -> Solution: Not care about that red key we used to open the door
                 pass
 
+        # The paths to all the candidates are found with a single search
+        if candidates:
+            paths = self._shortest_paths([obj_pos for _, obj_pos in candidates])
+
+        for obj, obj_pos in candidates:
+            assert paths[obj_pos] is not None
+            shortest_path_to_obj, with_blockers = paths[obj_pos]
+            distance_to_obj = len(shortest_path_to_obj)
+
+            if with_blockers:
+                # The distance should take into account the steps necessary
+                # to unblock the way. Instead of computing it exactly,
+                # we can use a lower bound on this number of steps
+                # which is 4 when the agent is not holding anything
+                # (pick, turn, drop, turn back
+                # and 7 if the agent is carrying something
+                # (turn, drop, turn back, pick,
+                # turn to other direction, drop, turn back)
+                distance_to_obj = (len(shortest_path_to_obj)
+                                   + (7 if self.mission.carrying else 4))
+
+            # If we looking for a door and we are currently in that cell
+            # that contains the door, it will take us at least 2
+            # (3 if `adjacent == True`) steps to reach the goal.`
+            if distance_to_obj == 0:
+                distance_to_obj = 3 if adjacent else 2
+
+            # If what we want is to face a location that is adjacent to an object,
+            # and if we are already right next to this object,
+            # then we should not prefer this object to those at distance 2
+            if adjacent and distance_to_obj == 1:
+                distance_to_obj = 3
+
+            if distance_to_obj < best_distance_to_obj:
+                best_distance_to_obj = distance_to_obj
+                best_pos = obj_pos
+                best_obj = obj
+                best_path = shortest_path_to_obj
+
+        self.search_cache['obj', obj_desc, adjacent] = (
+            self._agent_pos(), self.mission.agent_dir, best_path, (best_obj, best_pos))
         return best_obj, best_pos
 
     def _process_obs(self):
         """Parse the contents of an observation/image and update our state."""
 
-        grid, vis_mask = self.mission.gen_obs_grid()
-
-        pos = self.mission.agent_pos
-        f_vec = self.mission.dir_vec
-        r_vec = self.mission.right_vec
-
-        # Compute the absolute coordinates of the top-left corner
-        # of the agent's view area
-        top_left = pos + f_vec * (AGENT_VIEW_SIZE - 1) - r_vec * (AGENT_VIEW_SIZE // 2)
+        # The visibility mask of the view is computed, and cached, by the level
+        _, vis_mask = self.mission.gen_view()
 
         # Mark everything in front of us as visible
-        for vis_j in range(0, AGENT_VIEW_SIZE):
-            for vis_i in range(0, AGENT_VIEW_SIZE):
-
-                if not vis_mask[vis_i, vis_j]:
-                    continue
+        xs, ys, inside = self.mission.grid.view_coords(self.mission.agent_pos, self.mission.agent_dir)
+        visible = inside & vis_mask
+        self.vis_mask[xs[visible], ys[visible]] = True
+
+        # The cached searches are only valid as long as no new cell is seen,
+        # the grid (e.g. a door) does not change and the same object is carried
+        map_key = (self.mission.grid.version, self.mission.carrying,
+                   np.count_nonzero(self.vis_mask))
+        if map_key != self.map_key:
+            self.map_key = map_key
+            self.search_cache = {}
+
+    def _agent_pos(self):
+        i, j = self.mission.agent_pos
+        return int(i), int(j)
+
+    def _cached_search(self, key):
+        """Returns the path and the result of the last search made under
+        `key`, or None if there is no such search or it no longer applies.
+
+        A search applies if the agent is still where it started, facing
+        the same way or the first cell of the path found, or if the agent
+        has since moved to the first cell of the path, in which case the
+        rest of the path is still a shortest one, since the known map has
+        not changed.
 
-                # Compute the world coordinates of this cell
-                abs_i, abs_j = top_left - (f_vec * vis_j) + (r_vec * vis_i)
-
-                if abs_i < 0 or abs_i >= self.vis_mask.shape[0]:
-                    continue
-                if abs_j < 0 or abs_j >= self.vis_mask.shape[1]:
-                    continue
+        """
 
-                self.vis_mask[abs_i, abs_j] = True
+        entry = self.search_cache.get(key)
+        if entry is None:
+            return None
+        pos, dir, path, result = entry
+        agent_pos = self._agent_pos()
+        agent_dir = self.mission.agent_dir
+        if pos == agent_pos:
+            if dir != agent_dir:
+                if not path or path[0] != tuple(self.mission.front_pos):
+                    return None
+                self.search_cache[key] = (pos, agent_dir, path, result)
+            return path, result
+        if path and path[0] == agent_pos:
+            path = path[1:]
+            self.search_cache[key] = (agent_pos, agent_dir, path, result)
+            return path, result
+        return None
 
     def _remember_current_state(self):
         self.prev_agent_pos = self.mission.agent_pos
@@ -733,87 +934,115 @@ class Bot:
         but the current direction is also added to the queue to slightly prioritize
         going straight over turning.
 
+        Returns the path to the first accepted position, from that position
+        back to the initial one, the accepted position, the visited positions
+        in the order in which they were visited and the previous position of
+        every cell, as returned by `_bfs_previous_pos`.
+
         """
         self.bfs_counter += 1
 
-        queue = [(state, None) for state in initial_states]
         grid = self.mission.grid
-        previous_pos = dict()
-
-        while len(queue) > 0:
-            state, prev_pos = queue[0]
-            queue = queue[1:]
-            i, j, di, dj = state
-
-            if (i, j) in previous_pos:
+        width, height = grid.width, grid.height
+        cells = grid.grid
+        stop = self._bfs_stop_mask(ignore_blockers).ravel().tolist()
+
+        # Previous position of every cell, indexed by i * height + j: -1 for
+        # the initial positions and None for the cells not visited yet
+        previous_pos = [None] * (width * height)
+        visited = []
+        # The agent's position and direction are NumPy integers, which are
+        # much slower than Python integers
+        queue = deque((int(i), int(j), int(di), int(dj), -1) for i, j, di, dj in initial_states)
+        num_steps = 0
+
+        while queue:
+            i, j, di, dj, prev_pos = queue.popleft()
+            pos = i * height + j
+
+            if previous_pos[pos] is not None:
                 continue
 
-            self.bfs_step_counter += 1
-
-            cell = grid.get(i, j)
-            previous_pos[(i, j)] = prev_pos
+            num_steps += 1
+            previous_pos[pos] = prev_pos
+            visited.append((i, j))
 
             # If we reached a position satisfying the acceptance condition
-            if accept_fn((i, j), cell):
-                path = []
-                pos = (i, j)
-                while pos:
-                    path.append(pos)
-                    pos = previous_pos[pos]
-                return path, (i, j), previous_pos
-
-            # If this cell was not visually observed, don't expand from it
-            if not self.vis_mask[i, j]:
-                continue
+            if accept_fn((i, j), cells[j * width + i]):
+                self.bfs_step_counter += num_steps
+                return self._bfs_path(pos, previous_pos), (i, j), visited, previous_pos
 
-            if cell:
-                if cell.type == 'wall':
-                    continue
-                # If this is a door
-                elif cell.type == 'door':
-                    # If the door is closed, don't visit neighbors
-                    if not cell.is_open:
-                        continue
-                elif not ignore_blockers:
-                    continue
+            # Unseen cells, walls, closed doors and blockers are not expanded
+            if stop[pos]:
+                continue
 
             # Location to which the bot can get without turning
             # are put in the queue first
-            for k, l in [(di, dj), (dj, di), (-dj, -di), (-di, -dj)]:
-                next_pos = (i + k, j + l)
-                next_dir_vec = (k, l)
-                next_state = (*next_pos, *next_dir_vec)
-                queue.append((next_state, (i, j)))
+            for k, l in ((di, dj), (dj, di), (-dj, -di), (-di, -dj)):
+                if previous_pos[pos + k * height + l] is None:
+                    queue.append((i + k, j + l, k, l, pos))
 
         # Path not found
-        return None, None, previous_pos
-
-    def _shortest_path(self, accept_fn, try_with_blockers=False):
+        self.bfs_step_counter += num_steps
+        return None, None, visited, previous_pos
+
+    def _bfs_stop_mask(self, ignore_blockers):
+        """Mask of the cells from which the BFS does not go any further:
+        the cells that were not visually observed, the walls, the closed
+        doors and, unless `ignore_blockers` is set, the other objects."""
+
+        encoding = self.mission.grid.encoding
+        types = encoding[:, :, 0]
+        if ignore_blockers:
+            stop = types == OBJECT_TO_IDX['wall']
+        else:
+            stop = (types != OBJECT_TO_IDX['empty']) & (types != OBJECT_TO_IDX['door'])
+        stop |= (types == OBJECT_TO_IDX['door']) & (encoding[:, :, 2] != STATE_TO_IDX['open'])
+        stop |= ~self.vis_mask
+        return stop
+
+    def _bfs_path(self, pos, previous_pos):
+        """Path from a cell visited by the BFS back to the initial position,
+        given the previous position of every cell."""
+
+        height = self.mission.grid.height
+        path = []
+        while pos != -1:
+            path.append((pos // height, pos % height))
+            pos = previous_pos[pos]
+        return path
+
+    def _shortest_path(self, accept_fn, try_with_blockers=False, key=None):
         """
         Finds the path to any of the locations that satisfy `accept_fn`.
         Prefers the paths that avoid blockers for as long as possible.
+        If a `key` identifying `accept_fn` is given, the result is cached
+        and reused while the agent follows the path (see `_cached_search`).
         """
 
+        if key is not None:
+            cached = self._cached_search((key, try_with_blockers))
+            if cached is not None:
+                path, (finish, with_blockers) = cached
+                return path, finish, with_blockers
+
         # Initial states to visit (BFS)
         initial_states = [(*self.mission.agent_pos, *self.mission.dir_vec)]
 
         path = finish = None
         with_blockers = False
-        path, finish, previous_pos = self._breadth_first_search(
+        path, finish, visited, previous_pos = self._breadth_first_search(
             initial_states, accept_fn, ignore_blockers=False)
         if not path and try_with_blockers:
             with_blockers = True
-            path, finish, _ = self._breadth_first_search(
-                [(i, j, 1, 0) for i, j in previous_pos],
+            path, finish, _, _ = self._breadth_first_search(
+                [(i, j, 1, 0) for i, j in visited],
                 accept_fn, ignore_blockers=True)
             if path:
                 # `path` now contains the path to a cell that is reachable without
                 # blockers. Now let's add the path to this cell
-                pos = path[-1]
-                extra_path = []
-                while pos:
-                    extra_path.append(pos)
-                    pos = previous_pos[pos]
+                i, j = path[-1]
+                extra_path = self._bfs_path(i * self.mission.grid.height + j, previous_pos)
                 path = path + extra_path[1:]
 
         if path:
@@ -821,9 +1050,57 @@ class Bot:
             path = path[::-1]
             path = path[1:]
 
+        if key is not None:
+            self.search_cache[key, try_with_blockers] = (
+                self._agent_pos(), self.mission.agent_dir, path, (finish, with_blockers))
+
         # Note, that with_blockers only makes sense if path is not None
         return path, finish, with_blockers
 
+    def _shortest_paths(self, targets):
+        """
+        Performs the searches of `_shortest_path` with `try_with_blockers=True`
+        for several target locations at once. Returns a dictionary which gives
+        the path to every target and whether it goes through blockers, as
+        `_shortest_path` would, or None for the targets that can't be reached.
+        """
+
+        height = self.mission.grid.height
+        remaining = set(targets)
+
+        # The search goes on until the last remaining target is reached
+        def last_target(pos, cell):
+            remaining.discard(pos)
+            return not remaining
+
+        initial_states = [(*self.mission.agent_pos, *self.mission.dir_vec)]
+        _, _, visited, previous_pos = self._breadth_first_search(
+            initial_states, last_target, ignore_blockers=False)
+
+        paths = {}
+        for i, j in targets:
+            if previous_pos[i * height + j] is not None:
+                path = self._bfs_path(i * height + j, previous_pos)
+                paths[i, j] = (path[::-1][1:], False)
+        if not remaining:
+            return paths
+
+        # The other targets can only be reached through blockers
+        _, _, _, previous_pos_blockers = self._breadth_first_search(
+            [(i, j, 1, 0) for i, j in visited], last_target, ignore_blockers=True)
+        for i, j in targets:
+            if (i, j) in paths:
+                continue
+            if previous_pos_blockers[i * height + j] is None:
+                paths[i, j] = None
+                continue
+            path = self._bfs_path(i * height + j, previous_pos_blockers)
+            # Add the path to the cell that is reachable without blockers
+            k, l = path[-1]
+            path = path + self._bfs_path(k * height + l, previous_pos)[1:]
+            paths[i, j] = (path[::-1][1:], True)
+        return paths
+
     def _find_drop_pos(self, except_pos=None):
         """
         Find a position where an object can be dropped, ideally without blocking anything.
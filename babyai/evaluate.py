@@ -1,6 +1,8 @@
 import numpy as np
 import gym
 
+from babyai.levels.batch_env import BatchEnv
+
 
 # Returns the performance of the agent on the environment for a particular number of episodes.
 def evaluate(agent, env, episodes, model_agent=True, offsets=None):
@@ -56,15 +58,24 @@ def evaluate_demo_agent(agent, episodes):
 
 class ManyEnvs(gym.Env):
 
-    def __init__(self, envs):
+    def __init__(self, envs, snapshot_cache=None):
         self.envs = envs
         self.done = [False] * len(self.envs)
+        # With a cache, the levels of the seeds seen before are restored
+        # instead of being generated again
+        self.snapshot_cache = snapshot_cache
+        self.seeds = None
 
     def seed(self, seeds):
         [env.seed(seed) for seed, env in zip(seeds, self.envs)]
+        self.seeds = list(seeds)
 
     def reset(self):
-        many_obs = [env.reset() for env in self.envs]
+        if self.snapshot_cache is not None and self.seeds is not None:
+            many_obs = [self.snapshot_cache.reset(env, seed) for seed, env in zip(self.seeds, self.envs)]
+            self.seeds = None
+        else:
+            many_obs = [env.reset() for env in self.envs]
         self.done = [False] * len(self.envs)
         return many_obs
 
@@ -81,14 +92,21 @@ class ManyEnvs(gym.Env):
 
 
 # Returns the performance of the agent on the environment for a particular number of episodes.
-def batch_evaluate(agent, env_name, seed, episodes, return_obss_actions=False):
+# With `vectorized=True`, the environments are stepped together by a `BatchEnv`.
+# A `SnapshotCache` shared between calls makes repeated evaluations on the same
+# seeds skip the generation of the levels.
+def batch_evaluate(agent, env_name, seed, episodes, return_obss_actions=False, vectorized=False,
+                   snapshot_cache=None):
     num_envs = min(256, episodes)
 
     envs = []
     for i in range(num_envs):
         env = gym.make(env_name)
         envs.append(env)
-    env = ManyEnvs(envs)
+    if vectorized:
+        env = BatchEnv(envs, snapshot_cache=snapshot_cache)
+    else:
+        env = ManyEnvs(envs, snapshot_cache=snapshot_cache)
 
     logs = {
         "num_frames_per_episode": [],
@@ -7,6 +7,7 @@ import sys
 import itertools
 import torch
 from babyai.evaluate import batch_evaluate
+from babyai.levels.snapshot_cache import SnapshotCache
 import babyai.utils as utils
 from babyai.rl import DictList
 from babyai.model import ACModel
@@ -98,6 +99,9 @@ class ImitationLearning(object):
         if torch.cuda.is_available():
             self.acmodel.cuda()
 
+        # The validation episodes always use the same seeds
+        self.val_snapshot_cache = SnapshotCache()
+
         self.optimizer = torch.optim.Adam(self.acmodel.parameters(), self.args.lr, eps=self.args.optim_eps)
         self.scheduler = torch.optim.lr_scheduler.StepLR(self.optimizer, step_size=100, gamma=0.9)
 
@@ -282,7 +286,8 @@ class ImitationLearning(object):
 
         for env_name in ([self.args.env] if not getattr(self.args, 'multi_env', None)
                          else self.args.multi_env):
-            logs += [batch_evaluate(agent, env_name, self.args.val_seed, episodes)]
+            logs += [batch_evaluate(agent, env_name, self.args.val_seed, episodes,
+                                    snapshot_cache=self.val_snapshot_cache)]
         agent.model.train()
 
         return logs
@@ -336,7 +341,7 @@ class ImitationLearning(object):
             self.scheduler.step()
 
             log = self.run_epoch_recurrence(train_demos, is_training=True)
-            total_len = sum([len(item[3]) for item in train_demos])
+            total_len = utils.demos.num_frames(train_demos)
             status['num_frames'] += total_len
 
             update_end_time = time.time()
@@ -0,0 +1,234 @@
+"""
+Grid keeping a NumPy encoding of its contents up to date
+"""
+
+from copy import deepcopy
+
+import numpy as np
+from gym_minigrid.minigrid import (Grid, OBJECT_TO_IDX, COLOR_TO_IDX, STATE_TO_IDX,
+                                   AGENT_VIEW_SIZE, Wall)
+
+from .view import VIEW_OFFSETS, process_vis
+
+
+EMPTY_ENCODING = (OBJECT_TO_IDX['empty'], 0, 0)
+WALL_ENCODING = Wall().encode()
+
+
+def _run_labels(mask):
+    """
+    Label the runs of consecutive True cells along the second axis,
+    starting from 1, the False cells being labelled 0
+    """
+
+    width, height = mask.shape
+    padded = np.zeros((width, height + 1), dtype=bool)
+    padded[:, :height] = mask
+    flat = padded.ravel()
+    starts = flat.copy()
+    starts[1:] &= ~flat[:-1]
+    labels = np.cumsum(starts)
+    labels[~flat] = 0
+    return labels.reshape(width, height + 1)[:, :height]
+
+
+def flood_fill(passable, start):
+    """
+    Mask of the passable cells connected to `start` by horizontal and
+    vertical moves, empty if `start` is not passable
+
+    Rather than visiting the cells one by one, whole runs of passable
+    cells along the rows and the columns are filled at once, so the
+    number of iterations is the number of turns needed to reach the
+    farthest cell.
+    """
+
+    filled = np.zeros(passable.shape, dtype=bool)
+    if not passable[start]:
+        return filled
+    filled[start] = True
+
+    col_labels = _run_labels(passable)
+    row_labels = _run_labels(passable.T).T
+    num_filled = 1
+    while True:
+        for labels in (col_labels, row_labels):
+            hit = np.zeros(labels.max() + 1, dtype=bool)
+            hit[labels[filled]] = True
+            hit[0] = False
+            filled = hit[labels]
+        new_num_filled = np.count_nonzero(filled)
+        if new_num_filled == num_filled:
+            return filled
+        num_filled = new_num_filled
+
+
+class ArrayGrid(Grid):
+    """
+    Grid which keeps the encoding of every cell (type, color and state),
+    and whether the agent can see behind it, walk over it or pick it up,
+    in NumPy arrays, so that queries over the grid can use masks such as
+    `mask('key', 'red')` instead of going through the cells one by one
+
+    The arrays are updated when a cell is set. Objects changed in place,
+    such as doors being opened, have to be refreshed with `refresh_cell`.
+    `version` is incremented every time the arrays change.
+
+    The positions of the objects are also indexed by (type, color), so
+    that objects can be found without scanning the grid.
+    """
+
+    def __init__(self, width, height):
+        super().__init__(width, height)
+
+        self.encoding = np.zeros((width, height, 3), dtype='uint8')
+        self.encoding[:, :] = EMPTY_ENCODING
+        self.see_behind = np.ones((width, height), dtype=bool)
+        self.can_overlap = np.ones((width, height), dtype=bool)
+        self.can_pickup = np.zeros((width, height), dtype=bool)
+        self.version = 0
+        self.positions = {}
+
+    def __deepcopy__(self, memo):
+        # Walls are never changed, so copies of the grid share them
+        grid = ArrayGrid.__new__(ArrayGrid)
+        memo[id(self)] = grid
+        for name, value in self.__dict__.items():
+            if name == 'grid':
+                value = [v if v is None or v.type == 'wall' else deepcopy(v, memo)
+                         for v in value]
+            elif name == 'positions':
+                value = {key: set(positions) for key, positions in value.items()}
+            else:
+                value = deepcopy(value, memo)
+            setattr(grid, name, value)
+        return grid
+
+    @staticmethod
+    def from_grid(grid):
+        array_grid = ArrayGrid(grid.width, grid.height)
+        array_grid.grid = list(grid.grid)
+        array_grid.refresh()
+        return array_grid
+
+    def set(self, i, j, v):
+        old = self.get(i, j)
+        if old is not None:
+            self.positions[old.type, old.color].discard((i, j))
+        if v is not None:
+            self.positions.setdefault((v.type, v.color), set()).add((i, j))
+
+        super().set(i, j, v)
+        self._encode_cell(i, j, v)
+        self.version += 1
+
+    def find_positions(self, type=None, color=None):
+        """
+        Positions of the objects of a given type and color, None matching
+        any type or color, in the order in which a scan of the grid over
+        columns would find them
+        """
+
+        if type is not None and color is not None:
+            return sorted(self.positions.get((type, color), ()))
+
+        positions = []
+        for (obj_type, obj_color), obj_positions in self.positions.items():
+            if type is not None and obj_type != type:
+                continue
+            if color is not None and obj_color != color:
+                continue
+            positions.extend(obj_positions)
+        return sorted(positions)
+
+    def mask(self, type=None, color=None, state=None):
+        """
+        Boolean mask of the cells whose object has the given type, color
+        and state, None matching any of them. Each of them can also be a
+        list of values, e.g. `mask('door', state=['closed', 'locked'])`.
+        Empty cells have the type 'empty', and objects other than doors
+        have the state 'open'.
+        """
+
+        mask = np.ones((self.width, self.height), dtype=bool)
+        for channel, value, to_idx in ((0, type, OBJECT_TO_IDX),
+                                       (1, color, COLOR_TO_IDX),
+                                       (2, state, STATE_TO_IDX)):
+            if value is None:
+                continue
+            if isinstance(value, str):
+                mask &= self.encoding[:, :, channel] == to_idx[value]
+            else:
+                mask &= np.isin(self.encoding[:, :, channel], [to_idx[v] for v in value])
+        return mask
+
+    def refresh_cell(self, i, j):
+        """
+        Re-encode a cell, whose object may have been changed in place
+        """
+
+        encoding = tuple(self.encoding[i, j])
+        self._encode_cell(i, j, self.get(i, j))
+        if tuple(self.encoding[i, j]) != encoding:
+            self.version += 1
+
+    def refresh(self):
+        """
+        Re-encode and re-index the whole grid
+        """
+
+        self.positions = {}
+        for j in range(self.height):
+            for i in range(self.width):
+                v = self.get(i, j)
+                self._encode_cell(i, j, v)
+                if v is not None:
+                    self.positions.setdefault((v.type, v.color), set()).add((i, j))
+        self.version += 1
+
+    def _encode_cell(self, i, j, v):
+        if v is None:
+            self.encoding[i, j] = EMPTY_ENCODING
+            self.see_behind[i, j] = True
+            self.can_overlap[i, j] = True
+            self.can_pickup[i, j] = False
+        else:
+            self.encoding[i, j] = v.encode()
+            self.see_behind[i, j] = v.see_behind()
+            self.can_overlap[i, j] = v.can_overlap()
+            self.can_pickup[i, j] = v.can_pickup()
+
+    def view_coords(self, agent_pos, agent_dir):
+        """
+        World coordinates of the cells in the agent's view, and whether
+        they are inside of the grid
+        """
+
+        coords = VIEW_OFFSETS[agent_dir] + agent_pos
+        xs, ys = coords[..., 0], coords[..., 1]
+        inside = (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height)
+        return xs, ys, inside
+
+    def gen_view(self, agent_pos, agent_dir, see_through_walls=False):
+        """
+        Encoding and visibility mask of the agent's view, the same as
+        `MiniGridEnv.gen_obs_grid` followed by `Grid.encode`, except that
+        the cell of the agent is left as it is in the grid
+        """
+
+        xs, ys, inside = self.view_coords(agent_pos, agent_dir)
+        xs, ys = xs[inside], ys[inside]
+
+        image = np.empty((AGENT_VIEW_SIZE, AGENT_VIEW_SIZE, 3), dtype='uint8')
+        image[:, :] = WALL_ENCODING
+        image[inside] = self.encoding[xs, ys]
+
+        if see_through_walls:
+            vis_mask = np.ones((AGENT_VIEW_SIZE, AGENT_VIEW_SIZE), dtype=bool)
+        else:
+            see_behind = np.zeros((AGENT_VIEW_SIZE, AGENT_VIEW_SIZE), dtype=bool)
+            see_behind[inside] = self.see_behind[xs, ys]
+            vis_mask = process_vis(see_behind)
+
+        image[~vis_mask] = 0
+        return image, vis_mask
@@ -0,0 +1,249 @@
+"""
+Batch of BabyAI environments stepped in the same process, with the grids
+kept in stacked NumPy arrays
+"""
+
+import gym
+import numpy as np
+from gym_minigrid.minigrid import AGENT_VIEW_SIZE, DIR_TO_VEC, OBJECT_TO_IDX, Wall
+
+from .view import view_coords, process_vis
+
+
+EMPTY_ENCODING = (OBJECT_TO_IDX['empty'], 0, 0)
+WALL_ENCODING = Wall().encode()
+
+
+class BatchEnv(gym.Env):
+    """
+    A batch of `RoomGridLevel` environments stepped with array operations
+
+    The grids of all the environments are stored in stacked arrays, padded
+    with walls so that the views never fall outside of them. Turning,
+    moving forward and the extraction of the partial views are done for all
+    the environments at once. Picking up, dropping and toggling are decided
+    on the arrays, and only the affected environments touch their Python
+    objects, which the mission verifiers keep using.
+
+    The observations are the same as the ones of the per-environment `step`.
+    With `auto_reset=False`, environments that are done are not stepped
+    anymore and keep returning their last results, like `ManyEnvs`. With
+    `auto_reset=True`, they are reset like in `ParallelEnv`.
+
+    With a `SnapshotCache`, `reset` after `seed` restores the levels of the
+    seeds seen before instead of generating them again.
+    """
+
+    def __init__(self, envs, auto_reset=False, snapshot_cache=None):
+        assert len(envs) >= 1, "No environment given."
+
+        self.envs = envs
+        self.auto_reset = auto_reset
+        self.snapshot_cache = snapshot_cache
+        self.seeds = None
+        self.observation_space = self.envs[0].observation_space
+        self.action_space = self.envs[0].action_space
+        self.actions = self.envs[0].actions
+        self.done = [False] * len(self.envs)
+
+        # The margin makes sure that every view stays inside of the arrays
+        self.margin = AGENT_VIEW_SIZE
+        width = max(env.width for env in self.envs) + 2 * self.margin
+        height = max(env.height for env in self.envs) + 2 * self.margin
+        shape = (len(self.envs), width, height)
+
+        self.encoding = np.zeros(shape + (3,), dtype='uint8')
+        self.see_behind = np.zeros(shape, dtype=bool)
+        self.can_overlap = np.zeros(shape, dtype=bool)
+        self.can_pickup = np.zeros(shape, dtype=bool)
+        self.carrying = np.zeros((len(self.envs), 3), dtype='uint8')
+        self.agent_pos = np.zeros((len(self.envs), 2), dtype=np.int64)
+        self.agent_dir = np.zeros(len(self.envs), dtype=np.int64)
+
+        self.dir_vecs = np.array([DIR_TO_VEC[d] for d in range(4)])
+
+    def __len__(self):
+        return len(self.envs)
+
+    def seed(self, seeds):
+        [env.seed(seed) for seed, env in zip(seeds, self.envs)]
+        self.seeds = list(seeds)
+
+    def reset(self):
+        if self.snapshot_cache is not None and self.seeds is not None:
+            results = [self._reset_env(k, seed) for k, seed in enumerate(self.seeds)]
+            self.seeds = None
+        else:
+            results = [self._reset_env(k) for k in range(len(self.envs))]
+        self.done = [False] * len(self.envs)
+        self.last_results = [None] * len(self.envs)
+        return results
+
+    def step(self, actions):
+        actions = np.asarray(actions)
+        active = ~np.array(self.done)
+        if self.auto_reset:
+            active[:] = True
+        index = np.flatnonzero(active)
+
+        rewards, dones, infos, changed = self._step_arrays(index, actions[index])
+        images = self._gen_images(index)
+        # Like `RoomGridLevel.step`, the observation is generated before the
+        # changes made by the verifier, which only show at the next step
+        for k in changed:
+            self._load_env(k)
+
+        results = list(self.last_results)
+        for n, k in enumerate(index):
+            env = self.envs[k]
+            obs = {
+                'image': images[n],
+                'direction': int(self.agent_dir[k]),
+                'mission': env.mission
+            }
+            if self.auto_reset and dones[n]:
+                obs, _ = self._reset_env(k)
+            results[k] = (obs, rewards[n], dones[n], infos[n])
+
+        self.last_results = results
+        self.done = [result[2] for result in results]
+        return zip(*results)
+
+    def render(self):
+        raise NotImplementedError
+
+    def _reset_env(self, k, seed=None):
+        if seed is None:
+            obs, info = self.envs[k].reset()
+        else:
+            obs, info = self.snapshot_cache.reset(self.envs[k], seed)
+        self._load_env(k)
+        return obs, info
+
+    def _load_env(self, k):
+        """
+        Copy the grid and agent state of the k-th environment into the arrays
+        """
+
+        env = self.envs[k]
+        grid = env.grid
+        cells = (k, slice(self.margin, self.margin + grid.width),
+                 slice(self.margin, self.margin + grid.height))
+        self.encoding[k] = WALL_ENCODING
+        self.see_behind[k] = False
+        self.can_overlap[k] = False
+        self.can_pickup[k] = False
+        self.encoding[cells] = grid.encoding
+        self.see_behind[cells] = grid.see_behind
+        self.can_overlap[cells] = grid.can_overlap
+        self.can_pickup[cells] = grid.can_pickup
+        self.carrying[k] = env.carrying.encode() if env.carrying else EMPTY_ENCODING
+        self.agent_pos[k] = env.agent_pos
+        self.agent_dir[k] = env.agent_dir
+
+    def _load_cell(self, k, i, j):
+        grid = self.envs[k].grid
+        cell = (k, i + self.margin, j + self.margin)
+        self.encoding[cell] = grid.encoding[i, j]
+        self.see_behind[cell] = grid.see_behind[i, j]
+        self.can_overlap[cell] = grid.can_overlap[i, j]
+        self.can_pickup[cell] = grid.can_pickup[i, j]
+
+    def _step_arrays(self, index, actions):
+        """
+        Apply the actions to the environments in `index`, as `MiniGridEnv.step`
+        followed by `RoomGridLevel.verify_step` would. Also returns the
+        environments whose grid was changed by the verifier.
+        """
+
+        pos = self.agent_pos[index]
+        fwd_pos = pos + self.dir_vecs[self.agent_dir[index]]
+        fwd_i, fwd_j = fwd_pos[:, 0] + self.margin, fwd_pos[:, 1] + self.margin
+        fwd_type = self.encoding[index, fwd_i, fwd_j, 0]
+        fwd_empty = fwd_type == OBJECT_TO_IDX['empty']
+
+        # Turning
+        left = actions == self.actions.left
+        right = actions == self.actions.right
+        self.agent_dir[index[left]] = (self.agent_dir[index[left]] - 1) % 4
+        self.agent_dir[index[right]] = (self.agent_dir[index[right]] + 1) % 4
+
+        # Moving forward
+        forward = actions == self.actions.forward
+        move = forward & self.can_overlap[index, fwd_i, fwd_j]
+        self.agent_pos[index[move]] = fwd_pos[move]
+        goal = forward & (fwd_type == OBJECT_TO_IDX['goal'])
+        lava = forward & (fwd_type == OBJECT_TO_IDX['lava'])
+
+        # Interactions, which also have to be applied to the Python objects
+        carrying = self.carrying[index, 0] != OBJECT_TO_IDX['empty']
+        pickup = ((actions == self.actions.pickup)
+                  & self.can_pickup[index, fwd_i, fwd_j] & ~carrying)
+        drop = (actions == self.actions.drop) & fwd_empty & carrying
+        toggle = (actions == self.actions.toggle) & ~fwd_empty
+
+        rewards = [0] * len(index)
+        dones = [False] * len(index)
+        infos = [{} for _ in index]
+        changed = []
+
+        for n, k in enumerate(index):
+            env = self.envs[k]
+            env.step_count += 1
+            env.agent_pos = self.agent_pos[k].copy()
+            env.agent_dir = int(self.agent_dir[k])
+            cell_pos = fwd_pos[n]
+
+            if pickup[n]:
+                env.carrying = env.grid.get(*cell_pos)
+                env.carrying.cur_pos = np.array([-1, -1])
+                env.grid.set(*cell_pos, None)
+            elif drop[n]:
+                env.grid.set(*cell_pos, env.carrying)
+                env.carrying.cur_pos = cell_pos
+                env.carrying = None
+            elif toggle[n]:
+                env.grid.get(*cell_pos).toggle(env, cell_pos)
+                env.grid.refresh_cell(*cell_pos)
+            elif goal[n]:
+                dones[n] = True
+                rewards[n] = env._reward()
+            elif lava[n]:
+                dones[n] = True
+
+            if pickup[n] or drop[n] or toggle[n]:
+                self._load_cell(k, *cell_pos)
+                self.carrying[k] = env.carrying.encode() if env.carrying else EMPTY_ENCODING
+
+            if env.step_count >= env.max_steps:
+                dones[n] = True
+
+            # Some verifiers change the grid, e.g. `RepeatGoToInstr` shuffles
+            # the objects, in which case the arrays have to be loaded again
+            grid, version = env.grid, env.grid.version
+            rewards[n], dones[n] = env.verify_step(actions[n], rewards[n], dones[n], infos[n])
+            if env.grid is not grid or env.grid.version != version:
+                changed.append(k)
+
+        return rewards, dones, infos, changed
+
+    def _gen_images(self, index):
+        """
+        Generate the partial views of the environments in `index`, as
+        `MiniGridEnv.gen_obs` would
+        """
+
+        coords = view_coords(self.agent_pos[index], self.agent_dir[index]) + self.margin
+        rows = index[:, None, None]
+        xs, ys = coords[..., 0], coords[..., 1]
+
+        images = self.encoding[rows, xs, ys]
+        see_behind = self.see_behind[rows, xs, ys]
+        for n, k in enumerate(index):
+            if self.envs[k].see_through_walls:
+                see_behind[n] = True
+        vis_mask = process_vis(see_behind)
+
+        images[~vis_mask] = 0
+        images[:, AGENT_VIEW_SIZE // 2, AGENT_VIEW_SIZE - 1] = self.carrying[index]
+        return images
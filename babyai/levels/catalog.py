@@ -0,0 +1,268 @@
+"""
+Catalog of the missions generated by each level for each seed, stored in
+an SQLite database so that seeds can be selected without generating them
+"""
+
+import json
+import signal
+import sqlite3
+import time
+from multiprocessing import Pool
+
+from .levelgen import level_dict, RoomGridLevel
+from .verifier import SeqInstr, ThreeSeqInstr
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS missions (
+    level TEXT NOT NULL,
+    seed INTEGER NOT NULL,
+    mission TEXT,
+    instr_shape TEXT,
+    max_steps INTEGER,
+    num_objs INTEGER,
+    num_doors INTEGER,
+    gen_time REAL,
+    error TEXT,
+    PRIMARY KEY (level, seed)
+);
+CREATE INDEX IF NOT EXISTS missions_shape ON missions (level, instr_shape);
+CREATE INDEX IF NOT EXISTS missions_gen_time ON missions (level, gen_time);
+CREATE TABLE IF NOT EXISTS info (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+COLUMNS = ['level', 'seed', 'mission', 'instr_shape', 'max_steps',
+           'num_objs', 'num_doors', 'gen_time', 'error']
+
+
+def instr_shape(instr):
+    """
+    Shape of an instruction tree, e.g. Before(PutNext, GoTo)
+    """
+
+    name = type(instr).__name__
+    if name.endswith('Instr'):
+        name = name[:-len('Instr')]
+
+    if isinstance(instr, SeqInstr):
+        subinstrs = [instr.instr_a, instr.instr_b]
+    elif isinstance(instr, ThreeSeqInstr):
+        subinstrs = [instr.instr_a, instr.instr_b, instr.instr_c]
+    else:
+        return name
+
+    return '{}({})'.format(name, ', '.join(instr_shape(subinstr) for subinstr in subinstrs))
+
+
+def generation_mode(sample_valid_descs=False):
+    """
+    The settings which change the mission that the levels generate for a seed
+    """
+
+    return {'instr_retries': RoomGridLevel.instr_retries,
+            'sample_valid_descs': sample_valid_descs}
+
+
+class GenerationTimeout(BaseException):
+    """
+    Raised when the generation of a mission takes too long. It is not an
+    Exception, so that the retry loops of the levels do not catch it.
+    """
+
+    pass
+
+
+def _raise_timeout(signum, frame):
+    raise GenerationTimeout()
+
+
+def generate_level(level_name, seed, sample_valid_descs=False):
+    if not sample_valid_descs:
+        return level_dict[level_name](seed=seed)
+    # The levels generate a first mission when they are created, before the
+    # sampler can be chosen
+    env = level_dict[level_name]()
+    env.sample_valid_descs = True
+    env.seed(seed)
+    env.reset()
+    return env
+
+
+def describe_seed(level_name, seed, sample_valid_descs=False, timeout=None):
+    """
+    Generate the mission of a level for a seed and describe it as a catalog row
+
+    If the generation takes more than `timeout` seconds, it is interrupted,
+    which some levels need as they can get stuck on some seeds, and the row
+    records the timeout as an error. The time limit relies on SIGALRM, so it
+    must be called from the main thread.
+    """
+
+    start_time = time.perf_counter()
+    if timeout is not None:
+        previous_handler = signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        env = generate_level(level_name, seed, sample_valid_descs)
+    except GenerationTimeout:
+        return (level_name, seed, None, None, None, None, None,
+                time.perf_counter() - start_time, 'timeout after {}s'.format(timeout))
+    except Exception as error:
+        return (level_name, seed, None, None, None, None, None,
+                time.perf_counter() - start_time, repr(error))
+    finally:
+        if timeout is not None:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous_handler)
+    gen_time = time.perf_counter() - start_time
+
+    num_objs = 0
+    num_doors = 0
+    for obj in env.grid.grid:
+        if obj is None:
+            continue
+        if obj.type in ['key', 'ball', 'box']:
+            num_objs += 1
+        elif obj.type == 'door':
+            num_doors += 1
+    if env.carrying:
+        num_objs += 1
+
+    return (level_name, seed, env.surface, instr_shape(env.instrs), env.max_steps,
+            num_objs, num_doors, gen_time, None)
+
+
+def _describe_seed(args):
+    return describe_seed(*args)
+
+
+def build_catalog(path, level_names, seeds, processes=None, chunksize=16,
+                  sample_valid_descs=False, timeout=10, commit_interval=5):
+    """
+    Add the missions of the given levels and seeds to the catalog at `path`,
+    generating them in a pool of processes. Seeds already in the catalog
+    are skipped.
+
+    The catalog records the generation mode (see `generation_mode`), and a
+    catalog built in another mode can not be extended. Every seed is
+    generated within `timeout` seconds. The rows are committed at least
+    every `commit_interval` seconds, and when the build is interrupted, so
+    that a rerun only generates the missing seeds.
+    """
+
+    catalog = MissionCatalog(path)
+    catalog.set_mode(generation_mode(sample_valid_descs))
+    tasks = [(level_name, seed, sample_valid_descs, timeout)
+             for level_name in level_names
+             for seed in seeds
+             if (level_name, seed) not in catalog]
+
+    with Pool(processes) as pool:
+        rows = []
+        commit_time = time.perf_counter()
+        try:
+            for row in pool.imap_unordered(_describe_seed, tasks, chunksize):
+                rows.append(row)
+                if len(rows) >= 1000 or time.perf_counter() - commit_time >= commit_interval:
+                    catalog.insert(rows)
+                    rows = []
+                    commit_time = time.perf_counter()
+        finally:
+            catalog.insert(rows)
+
+    return catalog
+
+
+class MissionCatalog:
+    """
+    Missions generated by the levels for each seed, with their surface form,
+    instruction shape, time step limit, number of objects and doors, and the
+    time it took to generate them
+
+    Seeds whose generation raised an exception or timed out have an error
+    and no mission. The SQLite connection is available as `db` for other
+    queries.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def insert(self, rows):
+        with self.db:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO missions VALUES ({})'.format(', '.join('?' * len(COLUMNS))),
+                rows)
+
+    def mode(self):
+        """
+        The generation mode of the missions, or None if it was not recorded
+        """
+
+        row = self.db.execute("SELECT value FROM info WHERE name = 'mode'").fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_mode(self, mode):
+        """
+        Record the generation mode of the missions, which must be the mode
+        of the missions already in the catalog
+        """
+
+        current_mode = self.mode()
+        if current_mode is None:
+            if self.db.execute('SELECT 1 FROM missions').fetchone() is not None:
+                raise ValueError("the generation mode of the catalog {} is unknown".format(self.path))
+            with self.db:
+                self.db.execute("INSERT INTO info VALUES ('mode', ?)", (json.dumps(mode),))
+        elif current_mode != mode:
+            raise ValueError("the catalog {} was built with the generation mode {}, not {}".format(
+                self.path, current_mode, mode))
+
+    def __contains__(self, level_seed):
+        cursor = self.db.execute('SELECT 1 FROM missions WHERE level = ? AND seed = ?', level_seed)
+        return cursor.fetchone() is not None
+
+    def get(self, level_name, seed):
+        """
+        The catalog entry of a seed, as a dictionary, or None
+        """
+
+        cursor = self.db.execute('SELECT * FROM missions WHERE level = ? AND seed = ?', (level_name, seed))
+        row = cursor.fetchone()
+        return dict(zip(COLUMNS, row)) if row else None
+
+    def seeds(self, level_name, instr_shape=None, mission_like=None,
+              max_gen_time=None, min_gen_time=None, limit=None):
+        """
+        Seeds of a level, in increasing order, whose mission matches all the
+        given criteria. `mission_like` is an SQL LIKE pattern, such as
+        'pick up%'.
+        """
+
+        query = 'SELECT seed FROM missions WHERE level = ? AND error IS NULL'
+        params = [level_name]
+        if instr_shape is not None:
+            query += ' AND instr_shape = ?'
+            params.append(instr_shape)
+        if mission_like is not None:
+            query += ' AND mission LIKE ?'
+            params.append(mission_like)
+        if max_gen_time is not None:
+            query += ' AND gen_time <= ?'
+            params.append(max_gen_time)
+        if min_gen_time is not None:
+            query += ' AND gen_time >= ?'
+            params.append(min_gen_time)
+        query += ' ORDER BY seed'
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+
+        return [seed for seed, in self.db.execute(query, params)]
+
+    def close(self):
+        self.db.close()
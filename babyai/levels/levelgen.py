@@ -1,9 +1,15 @@
+import io
+import os
+import pickle
 import random
 from collections import OrderedDict
 from copy import deepcopy
 import gym
+import numpy as np
 from gym_minigrid.roomgrid import RoomGrid
+from gym_minigrid.minigrid import AGENT_VIEW_SIZE, OBJECT_TO_IDX, Wall
 from .verifier import *
+from .array_grid import ArrayGrid, EMPTY_ENCODING, flood_fill
 
 
 class RejectSampling(Exception):
@@ -14,14 +20,68 @@ class RejectSampling(Exception):
     pass
 
 
+# Environment flag giving the number of times rejected instructions are
+# resampled on the same layout before the whole grid is regenerated
+instr_retries = int(os.environ.get('BABYAI_INSTR_RETRIES', 0))
+
+
+# Attributes of the levels which are not part of their state
+SNAPSHOT_EXCLUDED = {'np_random', 'actions', 'action_space', 'observation_space',
+                     'reward_range', 'window', 'grid_render', 'obs_render',
+                     '_view', '_view_key'}
+
+
+class SnapshotPickler(pickle.Pickler):
+    """
+    Pickler of the state of a level, leaving out the level itself, which
+    the state refers to, and the walls, which never change and are shared
+    by all the restored states
+    """
+
+    def __init__(self, file, env):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.env = env
+        self.walls = []
+        self.wall_ids = {}
+
+    def persistent_id(self, obj):
+        if obj is self.env:
+            return 'env'
+        if type(obj) is Wall:
+            if id(obj) not in self.wall_ids:
+                self.wall_ids[id(obj)] = len(self.walls)
+                self.walls.append(obj)
+            return self.wall_ids[id(obj)]
+        return None
+
+
+class SnapshotUnpickler(pickle.Unpickler):
+    def __init__(self, file, env, walls):
+        super().__init__(file)
+        self.env = env
+        self.walls = walls
+
+    def persistent_load(self, pid):
+        if pid == 'env':
+            return self.env
+        return self.walls[pid]
+
+
 class RoomGridLevel(RoomGrid):
     """
     Base for levels based on RoomGrid
     A level, given a random seed, generates missions generated from
     one or more patterns. Levels should produce a family of missions
     of approximately similar difficulty.
+
+    When the instructions are rejected, up to `instr_retries` new ones are
+    generated on the same layout with `gen_instrs`, if the level implements
+    it, before the whole grid is regenerated. The mission generated for a
+    seed depends on `instr_retries`, with 0 giving the original missions.
     """
 
+    instr_retries = instr_retries
+
     def __init__(
         self,
         room_size=8,
@@ -37,6 +97,7 @@ class RoomGridLevel(RoomGrid):
 
         # Recreate the verifier
         self.instrs.reset_verifier(self)
+        self.verifier = CompiledVerifier(self.instrs, self)
 
         # Compute the time step limit based on the maze size and instructions
         nav_time_room = self.room_size ** 2
@@ -46,29 +107,109 @@ class RoomGridLevel(RoomGrid):
 
         return obs, {'status': ('continue', False)}
 
+    def snapshot(self):
+        """
+        Capture the state of the environment: grid, agent, carried object,
+        step count, random number generator and verifier. The state can be
+        brought back with `restore`, in this or another instance of the level.
+        """
+
+        state = {name: value for name, value in self.__dict__.items()
+                 if name not in SNAPSHOT_EXCLUDED}
+        file = io.BytesIO()
+        pickler = SnapshotPickler(file, self)
+        pickler.dump(state)
+        return {
+            'state': file.getvalue(),
+            'walls': pickler.walls,
+            'rng': self.np_random.get_state()
+        }
+
+    def restore(self, snapshot):
+        """
+        Bring back a state captured by `snapshot`, and return the observation
+        """
+
+        unpickler = SnapshotUnpickler(io.BytesIO(snapshot['state']), self, snapshot['walls'])
+        self.__dict__.update(unpickler.load())
+        self._view_key = None
+        self.np_random.set_state(snapshot['rng'])
+        return self.gen_obs()
+
+    @property
+    def grid(self):
+        return self._grid
+
+    @grid.setter
+    def grid(self, grid):
+        # Keep an up-to-date encoding of the grid, used to generate the observations
+        if grid is not None and not isinstance(grid, ArrayGrid):
+            grid = ArrayGrid.from_grid(grid)
+        self._grid = grid
+        self._view_key = None
+
+    def gen_view(self):
+        """
+        Generate the encoding and visibility mask of the agent's view
+        from the encoding kept by the grid. The result is cached until
+        the agent moves or the grid changes.
+        """
+
+        # Toggling the cell in front of the agent changes it in place
+        self.grid.refresh_cell(*self.front_pos)
+
+        key = (tuple(self.agent_pos), self.agent_dir, self.grid.version)
+        if key != self._view_key:
+            self._view = self.grid.gen_view(self.agent_pos, self.agent_dir, self.see_through_walls)
+            self._view_key = key
+        return self._view
+
+    def gen_obs(self):
+        """
+        Generate the agent's view (partially observable, low-resolution encoding)
+        """
+
+        image, _ = self.gen_view()
+
+        # The agent sees what it is carrying at its own position
+        image = image.copy()
+        image[AGENT_VIEW_SIZE // 2, AGENT_VIEW_SIZE - 1] = \
+            self.carrying.encode() if self.carrying else EMPTY_ENCODING
+
+        assert hasattr(self, 'mission'), "environments must define a textual mission string"
+
+        return {
+            'image': image,
+            'direction': self.agent_dir,
+            'mission': self.mission
+        }
+
     def step(self, action):
         obs, reward, done, info = super().step(action)
+        reward, done = self.verify_step(action, reward, done, info)
+        return obs, reward, done, info
 
-        # If we drop an object, we need to update its position in the environment
-        if action == self.actions.drop:
-            self.update_objs_poss()
+    def verify_step(self, action, reward, done, info):
+        """
+        Check the instructions after the agent has performed an action,
+        and update the reward, done flag and info dictionary accordingly
+        """
 
         # If we've successfully completed the mission
-        status = self.instrs.verify(action)
-        if isinstance(self.instrs, SeqInstr):
-            info['status'] = (self.instrs.a_done, self.instrs.b_done)
-        elif isinstance(self.instrs, ThreeSeqInstr):
-            info['status'] = tuple(self.instrs.done)
+        status = self.verifier.verify(action)
+        subinstrs_status = self.verifier.status()
+        if subinstrs_status is not None:
+            info['status'] = subinstrs_status
 
-        if status is 'success':
+        if status == SUCCESS:
             done = True
             reward = self._reward()
-        elif status is 'failure':
+        elif status == FAILURE:
             done = True
             reward = 0
             info['no_reward_reason'] = 'subtask_failed'
 
-        return obs, reward, done, info
+        return reward, done
 
     def update_objs_poss(self, instr=None):
         if instr is None:
@@ -90,7 +231,16 @@ class RoomGridLevel(RoomGrid):
                 self.gen_mission()
 
                 # Validate the instructions
-                self.validate_instrs(self.instrs)
+                num_retries = 0
+                while True:
+                    try:
+                        self.validate_instrs(self.instrs)
+                        break
+                    except RejectSampling:
+                        if num_retries >= self.instr_retries or not self.can_gen_instrs():
+                            raise
+                        num_retries += 1
+                        self.instrs = self.gen_instrs()
 
             except RecursionError as error:
                 print('Timeout during mission generation:', error)
@@ -106,6 +256,9 @@ class RoomGridLevel(RoomGrid):
         self.surface = self.instrs.surface(self)
         self.mission = self.surface
 
+        # Objects may have been changed in place during the generation
+        self.grid.refresh()
+
     def validate_instrs(self, instr):
         """
         Perform some validation on the generated instructions
@@ -171,6 +324,16 @@ class RoomGridLevel(RoomGrid):
         """
         raise NotImplementedError
 
+    def gen_instrs(self):
+        """
+        Generate new instructions for the current environment
+        Derived level classes may implement this method
+        """
+        raise NotImplementedError
+
+    def can_gen_instrs(self):
+        return type(self).gen_instrs is not RoomGridLevel.gen_instrs
+
     def add_new_objects(self, i=None, j=None, num_new_objs=10, all_unique=True, new_color=False, new_object=False):
         """
         Add objects that is might not be in the original BabyAI list of objects
@@ -258,6 +421,26 @@ class RoomGridLevel(RoomGrid):
                     if door:
                         door.is_open = True
 
+    def reachable_mask(self, pos=None):
+        """
+        Mask of the cells reachable from `pos`, the agent's starting
+        position by default, without moving any object: the empty cells
+        and doors connected to it, and the cells next to them
+        """
+
+        types = self.grid.encoding[:, :, 0]
+        passable = (types == OBJECT_TO_IDX['empty']) | (types == OBJECT_TO_IDX['door'])
+        i, j = self.start_pos if pos is None else pos
+
+        filled = flood_fill(passable, (i, j))
+        reachable = filled.copy()
+        reachable[1:, :] |= filled[:-1, :]
+        reachable[:-1, :] |= filled[1:, :]
+        reachable[:, 1:] |= filled[:, :-1]
+        reachable[:, :-1] |= filled[:, 1:]
+        reachable[i, j] = True
+        return reachable
+
     def check_objs_reachable(self, raise_exc=True):
         """
         Check that all objects are reachable from the agent's starting
@@ -265,49 +448,15 @@ class RoomGridLevel(RoomGrid):
         (without unblocking)
         """
 
-        # Reachable positions
-        reachable = set()
-
-        # Work list
-        stack = [self.start_pos]
-
-        while len(stack) > 0:
-            i, j = stack.pop()
-
-            if i < 0 or i >= self.grid.width or j < 0 or j >= self.grid.height:
-                continue
-
-            if (i, j) in reachable:
-                continue
-
-            # This position is reachable
-            reachable.add((i, j))
-
-            cell = self.grid.get(i, j)
-
-            # If there is something other than a door in this cell, it
-            # blocks reachability
-            if cell and cell.type is not 'door':
-                continue
-
-            # Visit the horizontal and vertical neighbors
-            stack.append((i+1, j))
-            stack.append((i-1, j))
-            stack.append((i, j+1))
-            stack.append((i, j-1))
-
-        # Check that all objects are reachable
-        for i in range(self.grid.width):
-            for j in range(self.grid.height):
-                cell = self.grid.get(i, j)
-
-                if not cell or cell.type is 'wall':
-                    continue
+        types = self.grid.encoding[:, :, 0]
+        unreachable = ((types != OBJECT_TO_IDX['empty']) & (types != OBJECT_TO_IDX['wall'])
+                       & ~self.reachable_mask())
 
-                if (i, j) not in reachable:
-                    if not raise_exc:
-                        return False
-                    raise RejectSampling('unreachable object at ' + str((i, j)))
+        if unreachable.any():
+            if not raise_exc:
+                return False
+            i, j = np.argwhere(unreachable)[0]
+            raise RejectSampling('unreachable object at ' + str((int(i), int(j))))
 
         # All objects reachable
         return True
@@ -331,6 +480,7 @@ class LevelGen(RoomGridLevel):
         implicit_unlock=True,
         action_kinds=['goto', 'pickup', 'open', 'putnext'],
         instr_kinds=['action', 'and', 'seq'],
+        sample_valid_descs=False,
         seed=None
     ):
         self.num_dists = num_dists
@@ -340,6 +490,7 @@ class LevelGen(RoomGridLevel):
         self.implicit_unlock = implicit_unlock
         self.action_kinds = action_kinds
         self.instr_kinds = instr_kinds
+        self.sample_valid_descs = sample_valid_descs
 
         self.locked_room = None
 
@@ -351,6 +502,8 @@ class LevelGen(RoomGridLevel):
         )
 
     def gen_mission(self):
+        # The locked room of the previous episode must not be excluded
+        self.locked_room = None
         if self._rand_float(0, 1) < self.locked_room_prob:
             self.add_locked_room()
 
@@ -373,7 +526,10 @@ class LevelGen(RoomGridLevel):
             self.check_objs_reachable()
 
         # Generate random instructions
-        self.instrs = self.rand_instr(
+        self.instrs = self.gen_instrs()
+
+    def gen_instrs(self):
+        return self.rand_instr(
             action_kinds=self.action_kinds,
             instr_kinds=self.instr_kinds
         )
@@ -422,6 +578,9 @@ class LevelGen(RoomGridLevel):
         Generate a random object descriptor
         """
 
+        if self.sample_valid_descs:
+            return self.rand_valid_obj(types, colors)
+
         num_tries = 0
 
         # Keep trying until we find a matching object
@@ -460,6 +619,83 @@ class LevelGen(RoomGridLevel):
             # Found a valid object description
             return desc
 
+    def rand_valid_obj(self, types=OBJ_TYPES, colors=COLOR_NAMES):
+        """
+        Generate a random object descriptor with a single draw
+
+        The descriptor is drawn from the descriptors matching at least one
+        object, with the same probabilities as `rand_obj` drawing a color,
+        type and location until they match an object. The random numbers are
+        not drawn like `rand_obj` does, so a seed gives a different mission,
+        which is why levels only use it with `sample_valid_descs`.
+        """
+
+        valid_descs = self.valid_obj_descs(types, colors)
+        if len(valid_descs) == 0:
+            raise RecursionError('failed to find suitable object')
+
+        # When locations are used, the location is None half of the time
+        weights = [len(LOC_NAMES) if loc is None and self.locations else 1
+                   for color, type, loc in valid_descs]
+
+        idx = self._rand_int(0, sum(weights))
+        for (color, type, loc), weight in zip(valid_descs, weights):
+            if idx < weight:
+                return ObjDesc(type, color, loc)
+            idx -= weight
+
+    def valid_obj_descs(self, types=OBJ_TYPES, colors=COLOR_NAMES):
+        """
+        List of the (color, type, loc) descriptors which match at least one
+        object, excluding the objects in the locked room if no implicit
+        unlocking is required
+        """
+
+        exclude_locked = not self.implicit_unlock and self.locked_room
+        if exclude_locked:
+            (locked_x, locked_y), (locked_w, locked_h) = self.locked_room.top, self.locked_room.size
+
+        # Locations apply only to objects in the room the agent starts in,
+        # and are relative to the agent's starting position and direction
+        agent_room = self.room_from_pos(*self.start_pos)
+        (room_x, room_y), (room_w, room_h) = agent_room.top, agent_room.size
+        start_x, start_y = self.start_pos
+        d1_x, d1_y = DIR_TO_VEC[self.start_dir]
+
+        valid_descs = set()
+        for (type, color), positions in self.grid.positions.items():
+            if type not in types:
+                continue
+            obj_colors = [None, color] if color in colors else [None]
+
+            for i, j in positions:
+                if (exclude_locked and locked_x <= i < locked_x + locked_w
+                        and locked_y <= j < locked_y + locked_h):
+                    continue
+
+                locs = [None]
+                if (self.locations and room_x <= i < room_x + room_w
+                        and room_y <= j < room_y + room_h):
+                    v_x, v_y = i - start_x, j - start_y
+                    # (d1, d2) is an oriented orthonormal basis
+                    v_d1 = v_x * d1_x + v_y * d1_y
+                    v_d2 = -v_x * d1_y + v_y * d1_x
+                    if v_d2 < 0:
+                        locs.append('left')
+                    if v_d2 > 0:
+                        locs.append('right')
+                    if v_d1 > 0:
+                        locs.append('front')
+                    if v_d1 < 0:
+                        locs.append('behind')
+
+                for obj_color in obj_colors:
+                    for loc in locs:
+                        valid_descs.add((obj_color, type, loc))
+
+        # Sorted, so that sampling is deterministic
+        return sorted(valid_descs, key=lambda desc: (desc[0] or '', desc[1], desc[2] or ''))
+
     def rand_instr(
         self,
         action_kinds,
@@ -472,16 +708,16 @@ class LevelGen(RoomGridLevel):
 
         kind = self._rand_elem(instr_kinds)
 
-        if kind is 'action':
+        if kind == 'action':
             action = self._rand_elem(action_kinds)
 
-            if action is 'goto':
+            if action == 'goto':
                 return GoToInstr(self.rand_obj())
-            elif action is 'pickup':
+            elif action == 'pickup':
                 return PickupInstr(self.rand_obj(types=OBJ_TYPES_NOT_DOOR))
-            elif action is 'open':
+            elif action == 'open':
                 return OpenInstr(self.rand_obj(types=['door']))
-            elif action is 'putnext':
+            elif action == 'putnext':
                 return PutNextInstr(
                     self.rand_obj(types=OBJ_TYPES_NOT_DOOR),
                     self.rand_obj()
@@ -489,7 +725,7 @@ class LevelGen(RoomGridLevel):
 
             assert False
 
-        elif kind is 'and':
+        elif kind == 'and':
             instr_a = self.rand_instr(
                 action_kinds=action_kinds,
                 instr_kinds=['action'],
@@ -502,7 +738,7 @@ class LevelGen(RoomGridLevel):
             )
             return AndInstr(instr_a, instr_b)
 
-        elif kind is 'seq':
+        elif kind == 'seq':
             instr_a = self.rand_instr(
                 action_kinds=action_kinds,
                 instr_kinds=['action', 'and'],
@@ -516,9 +752,9 @@ class LevelGen(RoomGridLevel):
 
             kind = self._rand_elem(['before', 'after'])
 
-            if kind is 'before':
+            if kind == 'before':
                 return BeforeInstr(instr_a, instr_b)
-            elif kind is 'after':
+            elif kind == 'after':
                 return AfterInstr(instr_a, instr_b)
 
             assert False
@@ -0,0 +1,42 @@
+"""
+Cache of the states of levels right after they were reset with a seed
+"""
+
+from collections import OrderedDict
+
+
+class SnapshotCache:
+    """
+    Snapshots of levels taken right after they were seeded and reset,
+    indexed by level and seed. Resetting to a seed seen before restores
+    the snapshot instead of generating the level again.
+
+    The least recently used snapshots are dropped beyond `max_size`.
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.snapshots = OrderedDict()
+
+    def reset(self, env, seed):
+        """
+        Same as `env.seed(seed)` followed by `env.reset()`
+        """
+
+        level = env.unwrapped
+        key = (level.level_name, seed)
+
+        if key in self.snapshots:
+            self.snapshots.move_to_end(key)
+            snapshot, info = self.snapshots[key]
+            return level.restore(snapshot), dict(info)
+
+        env.seed(seed)
+        obs, info = env.reset()
+        self.snapshots[key] = (level.snapshot(), dict(info))
+        if len(self.snapshots) > self.max_size:
+            self.snapshots.popitem(last=False)
+        return obs, info
+
+    def __len__(self):
+        return len(self.snapshots)
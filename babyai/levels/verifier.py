@@ -7,7 +7,7 @@ from gym_minigrid.minigrid import COLOR_NAMES, DIR_TO_VEC
 OBJ_TYPES = ['box', 'ball', 'key', 'door', 'triangle']
 
 # Object types we are allowed to describe in language
-OBJ_TYPES_NOT_DOOR = list(filter(lambda t: t is not 'door', OBJ_TYPES))
+OBJ_TYPES_NOT_DOOR = list(filter(lambda t: t != 'door', OBJ_TYPES))
 
 # Locations are all relative to the agent's starting position
 LOC_NAMES = ['left', 'right', 'front', 'behind']
@@ -109,54 +109,44 @@ class ObjDesc:
 
         agent_room = env.room_from_pos(*env.start_pos)
 
-        for i in range(env.grid.width):
-            for j in range(env.grid.height):
-                cell = env.grid.get(i, j)
-                if cell is None:
-                    continue
-
-                if not use_location:
-                    # we should keep tracking the same objects initially tracked only
-                    already_tracked = any([cell is obj for obj in self.obj_set])
-                    if not already_tracked:
-                        continue
+        # The grid indexes its objects by type and color
+        for i, j in env.grid.find_positions(self.type, self.color):
+            cell = env.grid.get(i, j)
 
-                # Check if object's type matches description
-                if self.type is not None and cell.type != self.type:
+            if not use_location:
+                # we should keep tracking the same objects initially tracked only
+                already_tracked = any([cell is obj for obj in self.obj_set])
+                if not already_tracked:
                     continue
 
-                # Check if object's color matches description
-                if self.color is not None and cell.color != self.color:
+            # Check if object's position matches description
+            if use_location and self.loc in ["left", "right", "front", "behind"]:
+                # Locations apply only to objects in the same room
+                # the agent starts in
+                if not agent_room.pos_inside(i, j):
                     continue
 
-                # Check if object's position matches description
-                if use_location and self.loc in ["left", "right", "front", "behind"]:
-                    # Locations apply only to objects in the same room
-                    # the agent starts in
-                    if not agent_room.pos_inside(i, j):
-                        continue
+                # Direction from the agent to the object
+                v = (i - env.start_pos[0], j - env.start_pos[1])
 
-                    # Direction from the agent to the object
-                    v = (i - env.start_pos[0], j - env.start_pos[1])
+                # (d1, d2) is an oriented orthonormal basis
+                d1 = DIR_TO_VEC[env.start_dir]
+                d2 = (-d1[1], d1[0])
 
-                    # (d1, d2) is an oriented orthonormal basis
-                    d1 = DIR_TO_VEC[env.start_dir]
-                    d2 = (-d1[1], d1[0])
+                # Check if object's position matches with location
+                pos_matches = {
+                    "left": dot_product(v, d2) < 0,
+                    "right": dot_product(v, d2) > 0,
+                    "front": dot_product(v, d1) > 0,
+                    "behind": dot_product(v, d1) < 0
+                }
 
-                    # Check if object's position matches with location
-                    pos_matches = {
-                        "left": dot_product(v, d2) < 0,
-                        "right": dot_product(v, d2) > 0,
-                        "front": dot_product(v, d1) > 0,
-                        "behind": dot_product(v, d1) < 0
-                    }
-
-                    if not (pos_matches[self.loc]):
-                        continue
+                if not (pos_matches[self.loc]):
+                    continue
 
-                if use_location:
-                    self.obj_set.append(cell)
-                self.obj_poss.append((i, j))
+            if use_location:
+                self.obj_set.append(cell)
+            self.obj_poss.append((i, j))
 
         return self.obj_set, self.obj_poss
 
@@ -368,7 +358,7 @@ class PickupInstr(ActionInstr):
 
     def __init__(self, obj_desc, strict=False):
         super().__init__()
-        assert obj_desc.type is not 'door'
+        assert obj_desc.type != 'door'
         self.desc = obj_desc
         self.strict = strict
 
@@ -415,7 +405,7 @@ class PutNextInstr(ActionInstr):
 
     def __init__(self, obj_move, obj_fixed, strict=False):
         super().__init__()
-        assert obj_move.type is not 'door'
+        assert obj_move.type != 'door'
         self.desc_move = obj_move
         self.desc_fixed = obj_fixed
         self.strict = strict
@@ -608,10 +598,10 @@ class AndInstr(SeqInstr):
         self.b_done = False
 
     def verify(self, action):
-        if self.a_done is not 'success':
+        if self.a_done != 'success':
             self.a_done = self.instr_a.verify(action)
 
-        if self.b_done is not 'success':
+        if self.b_done != 'success':
             self.b_done = self.instr_b.verify(action)
 
         if use_done_actions and action is self.env.actions.done:
@@ -648,10 +638,10 @@ class OrInstr(SeqInstr):
         self.b_done = False
 
     def verify(self, action):
-        if self.a_done is not 'success':
+        if self.a_done != 'success':
             self.a_done = self.instr_a.verify(action)
 
-        if self.b_done is not 'success':
+        if self.b_done != 'success':
             self.b_done = self.instr_b.verify(action)
 
         if use_done_actions and action is self.env.actions.done:
@@ -739,4 +729,359 @@ class ThreeOrderedInstr(ThreeSeqInstr):
                 if self.instr_list[self.tid[2]].verify(action) == 'success':
                     return 'failure'
 
-        return 'continue'
\ No newline at end of file
+        return 'continue'
+
+
+# Statuses of the compiled verifier, indexing the statuses returned by verify
+PENDING, NO_STATUS, CONTINUE, SUCCESS, FAILURE = range(5)
+STATUSES = (False, None, 'continue', 'success', 'failure')
+STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+
+
+class CompiledVerifier:
+    """
+    Verifier of an instruction tree, giving the same results as its `verify`
+    method, compiled when the episode starts
+
+    The instructions are flattened into lists of nodes, whose statuses are
+    integers. Each node is checked by a function specialized for its
+    instruction type, and action instructions only check the conditions
+    that the action being verified can change. `reset_verifier` must have
+    been called on the instructions.
+    """
+
+    def __init__(self, instrs, env):
+        self.env = env
+        self.actions = env.actions
+
+        self.instrs = []
+        self.runners = []
+        self.checks = []
+        self.children = []
+        self.strict = []
+        # Status that each node last returned to its parent
+        self.results = []
+        # Description refreshed after each node is verified, if any, and
+        # the grid version it was last refreshed for
+        self.descs = []
+        self.desc_versions = []
+
+        self.root = self._compile(instrs)
+
+        # Subinstructions of the root, in the order of their statuses
+        self.status_nodes = self.children[self.root]
+        if isinstance(instrs, ThreeSeqInstr) and self.status_nodes:
+            self.status_nodes = tuple(self.status_nodes[instrs.tid.index(i)] for i in range(3))
+
+        # Descriptions whose positions are updated when an object is dropped
+        self.drop_descs = self._find_drop_descs(instrs)
+
+    def _compile(self, instr):
+        node = len(self.instrs)
+        self.instrs.append(instr)
+        self.runners.append(None)
+        self.checks.append(None)
+        self.children.append(())
+        self.strict.append(getattr(instr, 'strict', False))
+        self.results.append(PENDING)
+        self.descs.append(None)
+        self.desc_versions.append(None)
+
+        if isinstance(instr, ActionInstr):
+            if type(instr) is OpenInstr:
+                self.checks[node] = self._check_open
+            elif type(instr) is GoToInstr:
+                self.checks[node] = self._check_goto
+            elif type(instr) is PickupInstr:
+                self.checks[node] = self._check_pickup
+            elif type(instr) is PutNextInstr:
+                self.checks[node] = self._check_putnext
+            else:
+                self.checks[node] = self._check_other
+            if use_done_actions:
+                self.runners[node] = self._run_done_action
+            else:
+                self.runners[node] = self._run_action
+            return node
+
+        if type(instr) is BeforeInstr:
+            runner = self._run_before
+        elif type(instr) is AfterInstr:
+            runner = self._run_after
+        elif type(instr) is AndInstr:
+            runner = self._run_and
+        elif type(instr) is OrInstr:
+            runner = self._run_or
+        elif type(instr) is ThreeOrderedInstr:
+            runner = self._run_three_ordered
+        else:
+            self.runners[node] = self._run_other
+            return node
+
+        if isinstance(instr, ThreeSeqInstr):
+            children = [self._compile(instr.instr_a),
+                        self._compile(instr.instr_b),
+                        self._compile(instr.instr_c)]
+            # Children in the order in which they must be completed
+            self.children[node] = tuple(children[i] for i in instr.tid)
+            # The description of each instruction is refreshed after it is verified
+            for child in children:
+                self.descs[child] = getattr(self.instrs[child], 'desc', None)
+        else:
+            self.children[node] = (self._compile(instr.instr_a),
+                                   self._compile(instr.instr_b))
+            # The description of the second instruction is refreshed every step
+            if runner == self._run_before:
+                instr_b = self.children[node][1]
+                self.descs[instr_b] = getattr(self.instrs[instr_b], 'desc', None)
+
+        self.runners[node] = runner
+        return node
+
+    def _find_drop_descs(self, instr):
+        # Same descriptions as updated by RoomGridLevel.update_objs_poss
+        if isinstance(instr, BeforeInstr) or isinstance(instr, AndInstr) or isinstance(instr, AfterInstr):
+            return self._find_drop_descs(instr.instr_a) + self._find_drop_descs(instr.instr_b)
+        return [getattr(instr, attr) for attr in ('desc', 'desc_move', 'desc_fixed')
+                if hasattr(instr, attr)]
+
+    def verify(self, action):
+        """
+        Verify the instructions after an action, returning one of the
+        CONTINUE, SUCCESS or FAILURE statuses
+        """
+
+        # If we drop an object, we need to update its position in the environment
+        if action == self.actions.drop:
+            for desc in self.drop_descs:
+                desc.find_matching_objs(self.env, use_location=False)
+
+        return self.runners[self.root](self.root, action)
+
+    def status(self):
+        """
+        Statuses of the subinstructions of the root instruction, as found
+        in the `a_done`, `b_done` or `done` attributes of the instruction
+        tree, or None if the root is not a sequence of instructions
+        """
+
+        if not self.status_nodes:
+            return None
+        return tuple([STATUSES[self.results[node]] for node in self.status_nodes])
+
+    def _refresh_desc(self, node, action):
+        desc = self.descs[node]
+        if desc is None:
+            return
+
+        # The matching objects only change when the grid does, or when their
+        # positions were updated after a drop
+        version = self.env.grid.version
+        if version != self.desc_versions[node] or action == self.actions.drop:
+            desc.find_matching_objs(self.env)
+            self.desc_versions[node] = version
+
+    def _run_action(self, node, action):
+        return self.checks[node](self.instrs[node], action)
+
+    def _run_done_action(self, node, action):
+        instr = self.instrs[node]
+        if action == self.actions.done:
+            return SUCCESS if instr.lastStepMatch else FAILURE
+
+        instr.lastStepMatch = self.checks[node](instr, action) == SUCCESS
+        return NO_STATUS
+
+    def _run_other(self, node, action):
+        return STATUS_CODES[self.instrs[node].verify(action)]
+
+    def _check_other(self, instr, action):
+        return STATUS_CODES[instr.verify_action(action)]
+
+    def _check_open(self, instr, action):
+        # Only verify when the toggle action is performed
+        if action != self.actions.toggle:
+            return CONTINUE
+
+        front_cell = self.env.grid.get(*self.env.front_pos)
+        if front_cell is None:
+            return CONTINUE
+
+        for door in instr.desc.obj_set:
+            if front_cell is door and door.is_open:
+                return SUCCESS
+
+        # If in strict mode and the wrong door is opened, failure
+        if instr.strict and front_cell.type == 'door':
+            return FAILURE
+
+        return CONTINUE
+
+    def _check_goto(self, instr, action):
+        # The agent must be next to (and facing) one of the objects
+        if tuple(self.env.front_pos) in instr.desc.obj_poss:
+            return SUCCESS
+        return CONTINUE
+
+    def _check_pickup(self, instr, action):
+        # To keep track of what was carried at the last time step
+        pre_carrying = instr.preCarrying
+        carrying = instr.preCarrying = self.env.carrying
+
+        # Only verify when the pickup action is performed
+        if action != self.actions.pickup:
+            return CONTINUE
+
+        if pre_carrying is None:
+            for obj in instr.desc.obj_set:
+                if carrying is obj:
+                    return SUCCESS
+
+        # If in strict mode and the wrong object is picked up, failure
+        if instr.strict and carrying:
+            return FAILURE
+
+        return CONTINUE
+
+    def _check_putnext(self, instr, action):
+        # To keep track of what was carried at the last time step
+        pre_carrying = instr.preCarrying
+        carrying = instr.preCarrying = self.env.carrying
+
+        # In strict mode, picking up the wrong object fails
+        if instr.strict and action == self.actions.pickup and carrying:
+            return FAILURE
+
+        # Only verify when the drop action is performed
+        if action != self.actions.drop:
+            return CONTINUE
+
+        for obj_a in instr.desc_move.obj_set:
+            if pre_carrying is obj_a:
+                for pos_b in instr.desc_fixed.obj_poss:
+                    if pos_next_to(obj_a.cur_pos, pos_b):
+                        return SUCCESS
+
+        return CONTINUE
+
+    def _run_before(self, node, action):
+        instr_a, instr_b = self.children[node]
+        results = self.results
+        runners = self.runners
+
+        if results[instr_a] != SUCCESS:
+            results[instr_a] = runners[instr_a](instr_a, action)
+            self._refresh_desc(instr_b, action)
+
+            if results[instr_a] == FAILURE:
+                return FAILURE
+
+            if results[instr_a] != SUCCESS:
+                # In strict mode, completing b first means failure
+                if self.strict[node] and runners[instr_b](instr_b, action) == SUCCESS:
+                    return FAILURE
+                return CONTINUE
+
+        results[instr_b] = runners[instr_b](instr_b, action)
+        self._refresh_desc(instr_b, action)
+
+        if results[instr_b] == FAILURE or results[instr_b] == SUCCESS:
+            return results[instr_b]
+        return CONTINUE
+
+    def _run_after(self, node, action):
+        instr_a, instr_b = self.children[node]
+        results = self.results
+        runners = self.runners
+
+        if results[instr_b] != SUCCESS:
+            results[instr_b] = runners[instr_b](instr_b, action)
+
+            if results[instr_b] == FAILURE:
+                return FAILURE
+
+            if results[instr_b] != SUCCESS:
+                # In strict mode, completing a first means failure
+                if self.strict[node] and runners[instr_a](instr_a, action) == SUCCESS:
+                    return FAILURE
+                return CONTINUE
+
+        results[instr_a] = runners[instr_a](instr_a, action)
+
+        if results[instr_a] == FAILURE or results[instr_a] == SUCCESS:
+            return results[instr_a]
+        return CONTINUE
+
+    def _run_and(self, node, action):
+        instr_a, instr_b = self.children[node]
+        results = self.results
+
+        if results[instr_a] != SUCCESS:
+            results[instr_a] = self.runners[instr_a](instr_a, action)
+        if results[instr_b] != SUCCESS:
+            results[instr_b] = self.runners[instr_b](instr_b, action)
+
+        if use_done_actions and action is self.actions.done:
+            if results[instr_a] == FAILURE and results[instr_b] == FAILURE:
+                return FAILURE
+
+        if results[instr_a] == SUCCESS and results[instr_b] == SUCCESS:
+            return SUCCESS
+        return CONTINUE
+
+    def _run_or(self, node, action):
+        instr_a, instr_b = self.children[node]
+        results = self.results
+
+        if results[instr_a] != SUCCESS:
+            results[instr_a] = self.runners[instr_a](instr_a, action)
+        if results[instr_b] != SUCCESS:
+            results[instr_b] = self.runners[instr_b](instr_b, action)
+
+        if use_done_actions and action is self.actions.done:
+            if results[instr_a] == FAILURE and results[instr_b] == FAILURE:
+                return FAILURE
+
+        if results[instr_a] == SUCCESS or results[instr_b] == SUCCESS:
+            return SUCCESS
+        return CONTINUE
+
+    def _run_three_ordered(self, node, action):
+        first, second, third = self.children[node]
+        results = self.results
+        runners = self.runners
+
+        if results[first] != SUCCESS:
+            results[first] = runners[first](first, action)
+            self._refresh_desc(first, action)
+
+            if results[first] == FAILURE:
+                return FAILURE
+
+            if results[first] != SUCCESS:
+                # In strict mode, completing the second or third first means failure
+                if self.strict[node]:
+                    if runners[second](second, action) == SUCCESS:
+                        return FAILURE
+                    if runners[third](third, action) == SUCCESS:
+                        return FAILURE
+                return CONTINUE
+
+        if results[second] != SUCCESS:
+            results[second] = runners[second](second, action)
+            self._refresh_desc(second, action)
+
+            if results[second] == FAILURE:
+                return FAILURE
+
+            if results[second] != SUCCESS:
+                if self.strict[node] and runners[third](third, action) == SUCCESS:
+                    return FAILURE
+                return CONTINUE
+
+        results[third] = runners[third](third, action)
+        self._refresh_desc(third, action)
+
+        if results[third] == FAILURE or results[third] == SUCCESS:
+            return results[third]
+        return CONTINUE
@@ -0,0 +1,103 @@
+"""
+Array-based computation of the agent's partial view, as done by
+`MiniGridEnv.gen_obs_grid`, for one or several agents at once
+"""
+
+import numpy as np
+from gym_minigrid.minigrid import AGENT_VIEW_SIZE, DIR_TO_VEC
+
+
+def _view_offsets(view_size):
+    """
+    Offsets, relative to the agent position, of the world cells shown in
+    the view, indexed by agent direction, then by view coordinates
+    """
+
+    offsets = np.zeros((4, view_size, view_size, 2), dtype=np.int64)
+    vis_i, vis_j = np.meshgrid(np.arange(view_size), np.arange(view_size), indexing='ij')
+
+    for agent_dir in range(4):
+        f_vec = np.array(DIR_TO_VEC[agent_dir])
+        r_vec = np.array((-f_vec[1], f_vec[0]))
+        top_left = f_vec * (view_size - 1) - r_vec * (view_size // 2)
+        offsets[agent_dir] = (top_left
+                              - f_vec * vis_j[:, :, None]
+                              + r_vec * vis_i[:, :, None])
+
+    return offsets
+
+
+VIEW_OFFSETS = _view_offsets(AGENT_VIEW_SIZE)
+
+
+def view_coords(agent_pos, agent_dir):
+    """
+    World coordinates of the cells in the view of each agent
+
+    agent_pos is an (N, 2) array and agent_dir an (N,) array, the result
+    is an (N, view_size, view_size, 2) array
+    """
+
+    agent_pos = np.asarray(agent_pos)
+    return agent_pos[:, None, None, :] + VIEW_OFFSETS[np.asarray(agent_dir)]
+
+
+def process_vis(see_behind):
+    """
+    Visibility masks of a batch of views, given whether each view cell
+    can be seen through, as computed by `Grid.process_vis`
+
+    see_behind is an (N, view_size, view_size) boolean array, or a single
+    (view_size, view_size) view
+    """
+
+    if see_behind.ndim == 2:
+        return _process_vis_single(see_behind)
+
+    num_views, width, height = see_behind.shape
+    mask = np.zeros((num_views, width, height), dtype=bool)
+    mask[:, width // 2, height - 1] = True
+
+    # Same propagation as the original, but applied to all the views
+    # at once: each row is swept left to right, then right to left
+    for j in reversed(range(0, height)):
+        for i in range(0, width - 1):
+            spread = mask[:, i, j] & see_behind[:, i, j]
+            mask[:, i + 1, j] |= spread
+            if j > 0:
+                mask[:, i + 1, j - 1] |= spread
+                mask[:, i, j - 1] |= spread
+
+        for i in reversed(range(1, width)):
+            spread = mask[:, i, j] & see_behind[:, i, j]
+            mask[:, i - 1, j] |= spread
+            if j > 0:
+                mask[:, i - 1, j - 1] |= spread
+                mask[:, i, j - 1] |= spread
+
+    return mask
+
+
+def _process_vis_single(see_behind):
+    # For a single view, plain Python lists are faster than NumPy operations
+    width, height = see_behind.shape
+    see_behind = see_behind.tolist()
+    mask = [[False] * height for _ in range(width)]
+    mask[width // 2][height - 1] = True
+
+    for j in reversed(range(0, height)):
+        for i in range(0, width - 1):
+            if mask[i][j] and see_behind[i][j]:
+                mask[i + 1][j] = True
+                if j > 0:
+                    mask[i + 1][j - 1] = True
+                    mask[i][j - 1] = True
+
+        for i in reversed(range(1, width)):
+            if mask[i][j] and see_behind[i][j]:
+                mask[i - 1][j] = True
+                if j > 0:
+                    mask[i - 1][j - 1] = True
+                    mask[i][j - 1] = True
+
+    return np.array(mask, dtype=bool)
@@ -1,4 +1,6 @@
 from abc import ABC, abstractmethod
+import copy
+import threading
 import torch
 import numpy
 
@@ -11,14 +13,16 @@ class BaseAlgo(ABC):
     """The base class for RL algorithms."""
 
     def __init__(self, envs, acmodel, num_frames_per_proc, discount, lr, gae_lambda, entropy_coef,
-                 value_loss_coef, max_grad_norm, recurrence, preprocess_obss, reshape_reward, aux_info):
+                 value_loss_coef, max_grad_norm, recurrence, preprocess_obss, reshape_reward, aux_info,
+                 pipelined=False, actor_learner=False):
         """
         Initializes a `BaseAlgo` instance.
 
         Parameters:
         ----------
-        envs : list
-            a list of environments that will be run in parallel
+        envs : list or ParallelEnv
+            a list of environments that will be run in parallel, or
+            an already constructed `ParallelEnv`
         acmodel : torch.Module
             the model
         num_frames_per_proc : int
@@ -47,11 +51,18 @@ class BaseAlgo(ABC):
         aux_info : list
             a list of strings corresponding to the name of the extra information
             retrieved from the environment for supervised auxiliary losses
+        pipelined : bool
+            if True, the environments are split in two halves and the actions
+            of one half are computed while the other half is being stepped
+        actor_learner : bool
+            if True, the next rollout is collected in a background thread,
+            with a copy of the model weights, while the parameters are updated
+            on the previous rollout
 
         """
         # Store parameters
 
-        self.env = ParallelEnv(envs)
+        self.env = envs if isinstance(envs, ParallelEnv) else ParallelEnv(envs)
         self.acmodel = acmodel
         self.acmodel.train()
         self.num_frames_per_proc = num_frames_per_proc
@@ -65,6 +76,8 @@ class BaseAlgo(ABC):
         self.preprocess_obss = preprocess_obss or default_preprocess_obss
         self.reshape_reward = reshape_reward
         self.aux_info = aux_info
+        self.pipelined = pipelined
+        self.actor_learner = actor_learner
 
         # Store helpers values
 
@@ -79,8 +92,9 @@ class BaseAlgo(ABC):
 
         shape = (self.num_frames_per_proc, self.num_procs)
 
-        self.obs = self.env.reset()
-        self.obss = [None]*(shape[0])
+        self.obs, _ = self.env.reset()
+        self.obs = list(self.obs)
+        self.obss = [[None]*(shape[1]) for _ in range(shape[0])]
 
         self.memory = torch.zeros(shape[1], self.acmodel.memory_size, device=self.device)
         self.memories = torch.zeros(*shape, self.acmodel.memory_size, device=self.device)
@@ -107,6 +121,25 @@ class BaseAlgo(ABC):
         self.log_reshaped_return = [0] * self.num_procs
         self.log_num_frames = [0] * self.num_procs
 
+        # In the actor/learner mode, the rollouts are collected with a copy of
+        # the model, whose weights lag `policy_lag` updates behind
+
+        self.actor_model = copy.deepcopy(self.acmodel) if self.actor_learner else self.acmodel
+        self.num_updates = 0
+        self.collection_thread = None
+        self.collection_result = None
+        self.collection_error = None
+
+        # The two halves of the environments used by the pipelined collection.
+        # The split has to fall on a block boundary of the `ParallelEnv`.
+
+        starts = self.env.starts
+        if self.pipelined and len(starts) > 1:
+            middle = starts[len(starts) // 2]
+            self.halves = [slice(0, middle), slice(middle, self.num_procs)]
+        else:
+            self.halves = [slice(0, self.num_procs)]
+
     def collect_experiences(self):
         """Collects rollouts and computes advantages.
 
@@ -128,70 +161,22 @@ class BaseAlgo(ABC):
             reward, policy loss, value loss, etc.
 
         """
+        # With a single half, this is the plain synchronous collection: act on
+        # all the environments, then step them. With two halves, the model
+        # acts on one half while the environments of the other half are stepped.
+
+        pending = [self._act(0, half) for half in self.halves]
         for i in range(self.num_frames_per_proc):
-            # Do one agent-environment interaction
-
-            preprocessed_obs = self.preprocess_obss(self.obs, device=self.device)
-            with torch.no_grad():
-                model_results = self.acmodel(preprocessed_obs, self.memory * self.mask.unsqueeze(1))
-                dist = model_results['dist']
-                value = model_results['value']
-                memory = model_results['memory']
-                extra_predictions = model_results['extra_predictions']
-
-            action = dist.sample()
-
-            obs, reward, done, env_info = self.env.step(action.cpu().numpy())
-            if self.aux_info:
-                env_info = self.aux_info_collector.process(env_info)
-                # env_info = self.process_aux_info(env_info)
-
-            # Update experiences values
-
-            self.obss[i] = self.obs
-            self.obs = obs
-
-            self.memories[i] = self.memory
-            self.memory = memory
-
-            self.masks[i] = self.mask
-            self.mask = 1 - torch.tensor(done, device=self.device, dtype=torch.float)
-            self.actions[i] = action
-            self.values[i] = value
-            if self.reshape_reward is not None:
-                self.rewards[i] = torch.tensor([
-                    self.reshape_reward(obs_, action_, reward_, done_)
-                    for obs_, action_, reward_, done_ in zip(obs, action, reward, done)
-                ], device=self.device)
-            else:
-                self.rewards[i] = torch.tensor(reward, device=self.device)
-            self.log_probs[i] = dist.log_prob(action)
-
-            if self.aux_info:
-                self.aux_info_collector.fill_dictionaries(i, env_info, extra_predictions)
-
-            # Update log values
-
-            self.log_episode_return += torch.tensor(reward, device=self.device, dtype=torch.float)
-            self.log_episode_reshaped_return += self.rewards[i]
-            self.log_episode_num_frames += torch.ones(self.num_procs, device=self.device)
-
-            for i, done_ in enumerate(done):
-                if done_:
-                    self.log_done_counter += 1
-                    self.log_return.append(self.log_episode_return[i].item())
-                    self.log_reshaped_return.append(self.log_episode_reshaped_return[i].item())
-                    self.log_num_frames.append(self.log_episode_num_frames[i].item())
-
-            self.log_episode_return *= self.mask
-            self.log_episode_reshaped_return *= self.mask
-            self.log_episode_num_frames *= self.mask
+            for k, half in enumerate(self.halves):
+                self._observe(i, half, *pending[k])
+                if i + 1 < self.num_frames_per_proc:
+                    pending[k] = self._act(i + 1, half)
 
         # Add advantage and return to experiences
 
         preprocessed_obs = self.preprocess_obss(self.obs, device=self.device)
         with torch.no_grad():
-            next_value = self.acmodel(preprocessed_obs, self.memory * self.mask.unsqueeze(1))['value']
+            next_value = self.actor_model(preprocessed_obs, self.memory * self.mask.unsqueeze(1))['value']
 
         for i in reversed(range(self.num_frames_per_proc)):
             next_mask = self.masks[i+1] if i < self.num_frames_per_proc - 1 else self.mask
@@ -250,6 +235,127 @@ class BaseAlgo(ABC):
 
         return exps, log
 
+    def get_experiences(self):
+        """Returns the experiences to use for the next update, as
+        `collect_experiences` does.
+
+        In the actor/learner mode, the experiences were collected while the
+        previous update was running, and the collection of the next ones is
+        started before returning, with the current weights of the model.
+        The number of updates between the weights that collected the returned
+        experiences and the current ones is logged as `policy_lag`."""
+        if not self.actor_learner:
+            exps, logs = self.collect_experiences()
+            logs["policy_lag"] = 0
+            self.num_updates += 1
+            return exps, logs
+
+        if self.collection_thread is None:
+            self._start_collection()
+        self.collection_thread.join()
+        if self.collection_error is not None:
+            error, self.collection_error = self.collection_error, None
+            self.collection_thread = None
+            raise error
+        exps, logs, version = self.collection_result
+        self.collection_result = None
+        logs["policy_lag"] = self.num_updates - version
+        self._start_collection()
+        self.num_updates += 1
+        return exps, logs
+
+    def _start_collection(self):
+        self.actor_model.load_state_dict(self.acmodel.state_dict())
+        version = self.num_updates
+
+        def collect():
+            try:
+                exps, logs = self.collect_experiences()
+                # The buffers are reused by the next collection, which runs
+                # while these experiences are used for the update
+                self.collection_result = _clone_tensors(exps), logs, version
+            except Exception as error:
+                # Raised in the main thread by `get_experiences`
+                self.collection_error = error
+
+        self.collection_thread = threading.Thread(target=collect, daemon=True)
+        self.collection_thread.start()
+
+    def _act(self, i, sl):
+        """Computes the actions of the environments in the slice `sl` for the
+        `i`-th frame and sends them to the environments, without waiting."""
+        preprocessed_obs = self.preprocess_obss(self.obs[sl], device=self.device)
+        with torch.no_grad():
+            model_results = self.actor_model(preprocessed_obs, self.memory[sl] * self.mask[sl].unsqueeze(1))
+            dist = model_results['dist']
+            value = model_results['value']
+            memory = model_results['memory']
+            extra_predictions = model_results['extra_predictions']
+
+        action = dist.sample()
+
+        self.env.step_async(action.cpu().numpy(), sl.start, sl.stop)
+
+        return action, dist.log_prob(action), value, memory, extra_predictions
+
+    def _observe(self, i, sl, action, log_prob, value, memory, extra_predictions):
+        """Waits for the environments in the slice `sl` to be stepped and
+        stores the `i`-th frame of their experience."""
+        obs, reward, done, env_info = self.env.step_wait(sl.start, sl.stop)
+        if self.aux_info:
+            env_info = self.aux_info_collector.process(env_info)
+            # env_info = self.process_aux_info(env_info)
+
+        # Update experiences values
+
+        self.obss[i][sl] = self.obs[sl]
+        self.obs[sl] = obs
+
+        self.memories[i][sl] = self.memory[sl]
+        self.memory[sl] = memory
+
+        self.masks[i][sl] = self.mask[sl]
+        self.mask[sl] = 1 - torch.tensor(done, device=self.device, dtype=torch.float)
+        self.actions[i][sl] = action
+        self.values[i][sl] = value
+        if self.reshape_reward is not None:
+            self.rewards[i][sl] = torch.tensor([
+                self.reshape_reward(obs_, action_, reward_, done_)
+                for obs_, action_, reward_, done_ in zip(obs, action, reward, done)
+            ], device=self.device)
+        else:
+            self.rewards[i][sl] = torch.tensor(reward, device=self.device)
+        self.log_probs[i][sl] = log_prob
+
+        if self.aux_info:
+            self.aux_info_collector.fill_dictionaries(i, env_info, extra_predictions, sl)
+
+        # Update log values
+
+        self.log_episode_return[sl] += torch.tensor(reward, device=self.device, dtype=torch.float)
+        self.log_episode_reshaped_return[sl] += self.rewards[i][sl]
+        self.log_episode_num_frames[sl] += 1
+
+        for j, done_ in enumerate(done, sl.start):
+            if done_:
+                self.log_done_counter += 1
+                self.log_return.append(self.log_episode_return[j].item())
+                self.log_reshaped_return.append(self.log_episode_reshaped_return[j].item())
+                self.log_num_frames.append(self.log_episode_num_frames[j].item())
+
+        self.log_episode_return[sl] *= self.mask[sl]
+        self.log_episode_reshaped_return[sl] *= self.mask[sl]
+        self.log_episode_num_frames[sl] *= self.mask[sl]
+
     @abstractmethod
     def update_parameters(self):
         pass
+
+
+def _clone_tensors(dictlist):
+    for key, value in dict.items(dictlist):
+        if torch.is_tensor(value):
+            dict.__setitem__(dictlist, key, value.clone())
+        elif isinstance(value, dict):
+            _clone_tensors(value)
+    return dictlist
@@ -14,12 +14,12 @@ class PPOAlgo(BaseAlgo):
                  gae_lambda=0.95,
                  entropy_coef=0.01, value_loss_coef=0.5, max_grad_norm=0.5, recurrence=4,
                  adam_eps=1e-5, clip_eps=0.2, epochs=4, batch_size=256, preprocess_obss=None,
-                 reshape_reward=None, aux_info=None):
+                 reshape_reward=None, aux_info=None, pipelined=False, actor_learner=False):
         num_frames_per_proc = num_frames_per_proc or 128
 
         super().__init__(envs, acmodel, num_frames_per_proc, discount, lr, gae_lambda, entropy_coef,
                          value_loss_coef, max_grad_norm, recurrence, preprocess_obss, reshape_reward,
-                         aux_info)
+                         aux_info, pipelined, actor_learner)
 
         self.clip_eps = clip_eps
         self.epochs = epochs
@@ -33,7 +33,7 @@ class PPOAlgo(BaseAlgo):
     def update_parameters(self):
         # Collect experiences
 
-        exps, logs = self.collect_experiences()
+        exps, logs = self.get_experiences()
         '''
         exps is a DictList with the following keys ['obs', 'memory', 'mask', 'action', 'value', 'reward',
          'advantage', 'returnn', 'log_prob'] and ['collected_info', 'extra_predictions'] if we use aux_info
@@ -94,6 +94,8 @@ class PPOAlgo(BaseAlgo):
 
                     entropy = dist.entropy().mean()
 
+                    # `sb.log_prob` comes from the policy that collected the experiences, so
+                    # the clipped ratio also corrects for the policy lag of the actor/learner mode
                     ratio = torch.exp(dist.log_prob(sb.action) - sb.log_prob)
                     surr1 = ratio * sb.advantage
                     surr2 = torch.clamp(ratio, 1.0 - self.clip_eps, 1.0 + self.clip_eps) * sb.advantage
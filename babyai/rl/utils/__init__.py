@@ -1,2 +1,2 @@
 from babyai.rl.utils.dictlist import DictList
-from babyai.rl.utils.penv import ParallelEnv
+from babyai.rl.utils.penv import EnvFactory, ParallelEnv
@@ -1,53 +1,396 @@
-from multiprocessing import Process, Pipe
+from multiprocessing import RawArray
+import multiprocessing
+import logging
+import copy
+import numpy
 import gym
 
-def worker(conn, env):
+logger = logging.getLogger(__name__)
+
+class EnvFactory:
+    """Builds an environment from its name and seed.
+
+    Unlike a live environment, a factory is cheap to send to a worker
+    process, which then builds the environment itself."""
+
+    def __init__(self, env_name, seed=None):
+        self.env_name = env_name
+        self.seed = seed
+
+    def __call__(self):
+        env = gym.make(self.env_name)
+        if self.seed is not None:
+            env.seed(self.seed)
+        return env
+
+def make_env(env):
+    """Build the environment if `env` is a factory."""
+    return env if isinstance(env, gym.Env) else env()
+
+def reset_envs(envs, ahead=None, bots=None):
+    results = [env.reset() for env in envs]
+    if ahead is not None:
+        ahead.discard()
+    if bots is not None:
+        for index, (_, info) in enumerate(results):
+            bots.start(index, info)
+    return results
+
+def step_envs(envs, actions, ahead=None, bots=None):
+    results = []
+    for index, (env, action) in enumerate(zip(envs, actions)):
+        obs, reward, done, info = env.step(action)
+        if done:
+            obs, info = env.reset() if ahead is None else ahead.next_episode(index)
+        if bots is not None:
+            if done:
+                bots.start(index, info)
+            else:
+                bots.replan(index, action, info)
+        results.append((obs, reward, done, info))
+    return results
+
+def same_rng_state(state_a, state_b):
+    return (state_a[2:] == state_b[2:] and state_a[0] == state_b[0]
+            and numpy.array_equal(state_a[1], state_b[1]))
+
+class ResetAhead:
+    """Generates the next episode of every environment of a worker while
+    the main process is busy, so that the end of an episode does not wait
+    for the generation of a new mission.
+
+    Every environment has a spare copy. Between two commands, the spare
+    copy is given the random state of the environment and reset: this is
+    the episode that the environment would generate at its next reset, as
+    the levels only draw random numbers when they are reset. When the
+    episode ends, the environment and its spare copy are swapped. If the
+    random state of the environment changed in the meantime, or the next
+    episode is not ready yet, the environment is reset as usual."""
+
+    def __init__(self, envs):
+        self.envs = envs
+        self.spares = [copy.deepcopy(env) for env in envs]
+        self.ready = [None] * len(envs)
+        self.pending = list(range(len(envs)))
+
+    def discard(self):
+        """Forget the next episodes, after the environments were reset."""
+        self.ready = [None] * len(self.envs)
+        self.pending = list(range(len(self.envs)))
+
+    def prepare(self, conn):
+        """Generate the next episodes until a command arrives."""
+        while self.pending and not conn.poll():
+            index = self.pending.pop(0)
+            rng_state = self.envs[index].unwrapped.np_random.get_state()
+            spare = self.spares[index]
+            spare.unwrapped.np_random.set_state(rng_state)
+            obs, info = spare.reset()
+            self.ready[index] = (rng_state, obs, info)
+
+    def next_episode(self, index):
+        """Start the next episode of an environment, and return its first
+        observation and info."""
+        env = self.envs[index]
+        ready = self.ready[index]
+        self.ready[index] = None
+        if ready is not None and same_rng_state(ready[0], env.unwrapped.np_random.get_state()):
+            self.envs[index], self.spares[index] = self.spares[index], env
+            _, obs, info = ready
+        else:
+            obs, info = env.reset()
+        if index not in self.pending:
+            self.pending.append(index)
+        return obs, info
+
+class EnvBots:
+    """The bots, such as `babyai.bot.Bot`, advising the agent in the
+    environments of a worker.
+
+    A bot is created by calling `bot` with the environment at the start of
+    every episode, and replans right after every step, next to its
+    environment. The action it suggests is added to the info dictionary as
+    `bot_action`, or None if the bot gave up on the episode. A bot gives up
+    when it raises one of the `expected_errors` of `bot`, by default an
+    `AssertionError`, which it does for the instructions it can not follow."""
+
+    def __init__(self, envs, bot):
+        self.envs = envs
+        self.bot = bot
+        self.bots = [None] * len(envs)
+        self.expected_errors = getattr(bot, 'expected_errors', (AssertionError,))
+
+    def start(self, index, info):
+        """Create the bot of the new episode of an environment."""
+        info["bot_action"] = None
+        try:
+            self.bots[index] = self.bot(self.envs[index].unwrapped)
+        except self.expected_errors as error:
+            self.give_up(index, error)
+            return
+        self.replan(index, None, info)
+
+    def replan(self, index, action, info):
+        """Let a bot know the action taken, and add its next action to the info."""
+        bot = self.bots[index]
+        info["bot_action"] = None
+        if bot is None:
+            return
+        try:
+            info["bot_action"] = int(bot.replan(None if action is None else int(action)))
+        except self.expected_errors as error:
+            self.give_up(index, error)
+
+    def give_up(self, index, error):
+        logger.info("the bot of environment {} of the process gave up on its episode: {!r}".format(index, error))
+        self.bots[index] = None
+
+def reset_envs_shared(envs, start, buffers, ahead=None, bots=None):
+    messages = []
+    for index, (obs, info) in enumerate(reset_envs(envs, ahead, bots), start):
+        buffers.write(index, obs)
+        messages.append((obs["mission"], info))
+    return messages
+
+def step_envs_shared(envs, actions, start, buffers, ahead=None, bots=None):
+    messages = []
+    for index, (obs, reward, done, info) in enumerate(step_envs(envs, actions, ahead, bots), start):
+        buffers.write(index, obs, reward, done)
+        # The mission only changes when the episode is reset
+        messages.append((obs["mission"] if done else None, info))
+    return messages
+
+def worker(conn, envs, reset_ahead=False, bot=None):
+    envs = [make_env(env) for env in envs]
+    ahead = ResetAhead(envs) if reset_ahead else None
+    bots = EnvBots(envs, bot) if bot is not None else None
     while True:
-        cmd, data = conn.recv()
+        if ahead is not None:
+            ahead.prepare(conn)
+        try:
+            cmd, data = conn.recv()
+        except EOFError:
+            # The main process dropped the ParallelEnv
+            return
         if cmd == "step":
-            obs, reward, done, info = env.step(data)
-            if done:
-                obs, info = env.reset()
-            conn.send((obs, reward, done, info))
+            conn.send(step_envs(envs, data, ahead, bots))
         elif cmd == "reset":
-            obs, info = env.reset()
-            conn.send((obs, info))
+            conn.send(reset_envs(envs, ahead, bots))
+        else:
+            raise NotImplementedError
+
+def shared_memory_worker(conn, envs, start, buffers, reset_ahead=False, bot=None):
+    buffers.attach()
+    envs = [make_env(env) for env in envs]
+    ahead = ResetAhead(envs) if reset_ahead else None
+    bots = EnvBots(envs, bot) if bot is not None else None
+    while True:
+        if ahead is not None:
+            ahead.prepare(conn)
+        try:
+            cmd, data = conn.recv()
+        except EOFError:
+            # The main process dropped the ParallelEnv
+            return
+        if cmd == "step":
+            conn.send(step_envs_shared(envs, data, start, buffers, ahead, bots))
+        elif cmd == "reset":
+            conn.send(reset_envs_shared(envs, start, buffers, ahead, bots))
         else:
             raise NotImplementedError
 
+class SharedMemoryBuffers:
+    """Preallocated shared-memory arrays holding the images, directions,
+    rewards and dones of several environments.
+
+    Every environment writes to its own row, so no locking is needed:
+    the main process only reads the arrays after all the workers have
+    acknowledged the command through their pipe."""
+
+    def __init__(self, num_envs, image_shape, image_dtype=numpy.uint8):
+        self.num_envs = num_envs
+        self.image_shape = tuple(image_shape)
+        self.image_dtype = numpy.dtype(image_dtype)
+
+        image_size = num_envs * int(numpy.prod(self.image_shape))
+        self.raw_images = RawArray('b', image_size * self.image_dtype.itemsize)
+        self.raw_directions = RawArray('q', num_envs)
+        self.raw_rewards = RawArray('d', num_envs)
+        self.raw_dones = RawArray('b', num_envs)
+        self.attach()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ('images', 'directions', 'rewards', 'dones'):
+            state.pop(key, None)
+        return state
+
+    def attach(self):
+        """Create the NumPy views of the shared arrays."""
+        self.images = numpy.frombuffer(self.raw_images, dtype=self.image_dtype).reshape(
+            self.num_envs, *self.image_shape)
+        self.directions = numpy.frombuffer(self.raw_directions, dtype=numpy.int64)
+        self.rewards = numpy.frombuffer(self.raw_rewards, dtype=numpy.float64)
+        self.dones = numpy.frombuffer(self.raw_dones, dtype=numpy.bool_)
+
+    def write(self, index, obs, reward=0, done=False):
+        self.images[index] = obs["image"]
+        self.directions[index] = obs["direction"]
+        self.rewards[index] = reward
+        self.dones[index] = done
+
 class ParallelEnv(gym.Env):
-    """A concurrent execution of environments in multiple processes."""
+    """A concurrent execution of environments in multiple processes.
 
-    def __init__(self, envs):
+    The environments are split in blocks of `envs_per_worker` consecutive
+    environments. Every block but the first one is stepped by its own worker
+    process, which returns the results for the whole block at once; the first
+    block is stepped in the main process.
+
+    With `shared_memory=True`, the workers write the images, directions,
+    rewards and dones of their environments into preallocated shared-memory
+    arrays, and only the info dictionaries (plus the mission, when an episode
+    is reset) are sent through the pipe. This removes the pickling of
+    observations from the training hot path.
+
+    With `reset_ahead=True`, the workers generate the next episode of their
+    environments while waiting for the next command (see `ResetAhead`), so
+    that a step which ends an episode costs about as much as any other. The
+    first block is then stepped by a worker as well.
+
+    The environments can be given as factories, such as `EnvFactory`, instead
+    of live environments. Every worker then builds its own environments, in
+    parallel with the other workers, and the environments never have to be
+    sent to the workers, which matters with the "spawn" and "forkserver"
+    `start_method`s.
+
+    With a `bot`, such as `babyai.bot.Bot`, every environment is advised by
+    a bot running in the same process (see `EnvBots`). The actions suggested
+    for the current observations are in `bot_actions`, so that expert actions
+    for all the environments come with the step instead of being computed
+    one environment after another in the main process."""
+
+    def __init__(self, envs, shared_memory=False, envs_per_worker=1, reset_ahead=False,
+                 start_method=None, bot=None):
         assert len(envs) >= 1, "No environment given."
+        assert envs_per_worker >= 1, "Each worker needs at least one environment."
 
         self.envs = envs
-        self.observation_space = self.envs[0].observation_space
-        self.action_space = self.envs[0].action_space
+        self.shared_memory = shared_memory
+        self.envs_per_worker = envs_per_worker
+        self.reset_ahead = reset_ahead
+        self.bot = bot
 
+        # Start index of every block of environments
+        self.starts = list(range(0, len(self.envs), self.envs_per_worker))
+        # Index of the first block stepped by a worker
+        self.first_remote = 0 if self.reset_ahead else 1
+        self.local_envs = [make_env(env) for env in self.envs[:self.envs_per_worker * self.first_remote]]
+        self.local_bots = EnvBots(self.local_envs, bot) if bot is not None else None
+        self.bot_actions = [None] * len(self.envs)
+
+        first_env = self.local_envs[0] if self.local_envs else make_env(self.envs[0])
+        self.observation_space = first_env.observation_space
+        self.action_space = first_env.action_space
+
+        if self.shared_memory:
+            image_space = self.observation_space.spaces["image"]
+            self.buffers = SharedMemoryBuffers(len(self.envs), image_space.shape, image_space.dtype)
+            self.missions = [None] * len(self.envs)
+
+        context = multiprocessing.get_context(start_method)
         self.locals = []
-        for env in self.envs[1:]:
-            local, remote = Pipe()
+        for start in self.starts[self.first_remote:]:
+            block = self.envs[start:start + self.envs_per_worker]
+            local, remote = context.Pipe()
             self.locals.append(local)
-            p = Process(target=worker, args=(remote, env))
+            if self.shared_memory:
+                p = context.Process(target=shared_memory_worker,
+                                    args=(remote, block, start, self.buffers, self.reset_ahead, self.bot))
+            else:
+                p = context.Process(target=worker, args=(remote, block, self.reset_ahead, self.bot))
             p.daemon = True
             p.start()
             remote.close()
 
+    def __len__(self):
+        return len(self.envs)
+
     def reset(self):
         for local in self.locals:
             local.send(("reset", None))
-        results = zip(*[self.envs[0].reset()] + [local.recv() for local in self.locals])
-        return results
+        if self.shared_memory:
+            messages = reset_envs_shared(self.local_envs, 0, self.buffers, bots=self.local_bots)
+            for local in self.locals:
+                messages += local.recv()
+            self.missions = [mission for mission, _ in messages]
+            infos = tuple(info for _, info in messages)
+            self._read_bot_actions(infos)
+            return self._read_obss(), infos
+        results = reset_envs(self.local_envs, bots=self.local_bots)
+        for local in self.locals:
+            results += local.recv()
+        self._read_bot_actions([info for _, info in results])
+        return zip(*results)
 
     def step(self, actions):
-        for local, action in zip(self.locals, actions[1:]):
-            local.send(("step", action))
-        obs, reward, done, info = self.envs[0].step(actions[0])
-        if done:
-            obs, info = self.envs[0].reset()
-        results = zip(*[(obs, reward, done, info)] + [local.recv() for local in self.locals])
-        return results
+        self.step_async(actions)
+        return self.step_wait()
+
+    def step_async(self, actions, start=0, end=None):
+        """Send the actions for the environments in `[start, end)`, without
+        waiting for the results. The range must be made of whole blocks of
+        environments. The environments of the main process are only stepped
+        when `step_wait` is called."""
+        for block in self._blocks(start, end):
+            block_actions = actions[self.starts[block] - start:][:self.envs_per_worker]
+            if block < self.first_remote:
+                self.local_actions = block_actions
+            else:
+                self.locals[block - self.first_remote].send(("step", block_actions))
+
+    def step_wait(self, start=0, end=None):
+        """Wait for the results of the last `step_async` call for the
+        environments in `[start, end)`."""
+        blocks = self._blocks(start, end)
+        results = []
+        for block in blocks:
+            if block < self.first_remote:
+                if self.shared_memory:
+                    results += step_envs_shared(self.local_envs, self.local_actions, 0, self.buffers,
+                                                bots=self.local_bots)
+                else:
+                    results += step_envs(self.local_envs, self.local_actions, bots=self.local_bots)
+            else:
+                results += self.locals[block - self.first_remote].recv()
+        if self.shared_memory:
+            end = start + len(results)
+            for i, (mission, _) in enumerate(results, start):
+                if mission is not None:
+                    self.missions[i] = mission
+            infos = tuple(info for _, info in results)
+            self._read_bot_actions(infos, start)
+            return (self._read_obss(start, end), tuple(self.buffers.rewards[start:end].tolist()),
+                    tuple(self.buffers.dones[start:end].tolist()), infos)
+        self._read_bot_actions([info for _, _, _, info in results], start)
+        return zip(*results)
+
+    def _blocks(self, start, end):
+        end = len(self.envs) if end is None else end
+        assert start in self.starts and (end in self.starts or end == len(self.envs)), \
+            "the range of environments must be made of whole blocks"
+        return range(self.starts.index(start), (self.starts + [len(self.envs)]).index(end))
+
+    def _read_bot_actions(self, infos, start=0):
+        if self.bot is not None:
+            self.bot_actions[start:start + len(infos)] = [info["bot_action"] for info in infos]
+
+    def _read_obss(self, start=0, end=None):
+        # The buffers are overwritten at the next step, so the images are copied
+        images = self.buffers.images[start:end].copy()
+        directions = self.buffers.directions[start:end].tolist()
+        return tuple({"image": image, "direction": direction, "mission": mission}
+                     for image, direction, mission in zip(images, directions, self.missions[start:end]))
 
     def render(self):
-        raise NotImplementedError
\ No newline at end of file
+        raise NotImplementedError
@@ -46,11 +46,12 @@ class ExtraInfoCollector:
         # env_info is now a dict of lists
         return env_info
 
-    def fill_dictionaries(self, index, env_info, extra_predictions):
+    def fill_dictionaries(self, index, env_info, extra_predictions, sl=slice(None)):
+        # `sl` selects the environments the info and predictions belong to
         for info in self.aux_info:
             dtype = torch.long if required_heads[info].startswith('multiclass') else torch.float
-            self.collected_info[info][index] = torch.tensor(env_info[info], dtype=dtype, device=self.device)
-            self.extra_predictions[info][index] = extra_predictions[info]
+            self.collected_info[info][index][sl] = torch.tensor(env_info[info], dtype=dtype, device=self.device)
+            self.extra_predictions[info][index][sl] = extra_predictions[info]
 
     def end_collection(self, exps):
         collected_info = dict()
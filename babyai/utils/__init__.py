@@ -2,7 +2,7 @@ import os
 import random
 import numpy
 import torch
-from babyai.utils.agent import load_agent, ModelAgent, DemoAgent, BotAgent
+from babyai.utils.agent import load_agent, ModelAgent, DemoAgent, BotAgent, BatchBotAgent
 from babyai.utils.demos import (
     load_demos, save_demos, synthesize_demos, get_demos_path)
 from babyai.utils.format import ObssPreprocessor, IntObssPreprocessor, get_vocab_path
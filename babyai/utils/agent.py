@@ -1,5 +1,6 @@
 from abc import ABC, abstractmethod
 import torch
+from gym_minigrid.minigrid import MiniGridEnv
 from .. import utils
 from babyai.bot import Bot
 from babyai.model import ACModel
@@ -154,6 +155,33 @@ class BotAgent:
         pass
 
 
+class BatchBotAgent:
+    """An agent based on the bots of a `ParallelEnv` created with `bot=Bot`.
+
+    The bots run next to their environments, in the processes of the
+    `ParallelEnv`, and replan as soon as their environment is stepped, so
+    `act_batch` only reads the actions they suggested for all the environments.
+    Unlike an `Agent`, it can not act on a single observation, so it has no `act`."""
+
+    def __init__(self, penv):
+        assert penv.bot is not None, "the ParallelEnv has no bots"
+        self.penv = penv
+
+    def act_batch(self, many_obs):
+        if len(many_obs) != len(self.penv):
+            raise ValueError("act on all the environments of the ParallelEnv at once")
+        # The bots that gave up on their episode are done
+        actions = [MiniGridEnv.Actions.done if action is None else action
+                   for action in self.penv.bot_actions]
+        return {'action': torch.tensor(actions)}
+
+    def on_reset(self):
+        pass
+
+    def analyze_feedback(self, reward, done):
+        pass
+
+
 def load_agent(env, model_name, demos_name=None, demos_origin=None, argmax=True, env_name=None):
     # env_name needs to be specified for demo agents
     if model_name == 'BOT':
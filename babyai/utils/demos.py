@@ -1,6 +1,9 @@
 import os
+import json
 import pickle
 
+import numpy
+
 from .. import utils
 import blosc
 
@@ -13,7 +16,18 @@ def get_demos_path(demos=None, env=None, origin=None, valid=False):
     return os.path.join(utils.storage_dir(), 'demos', demos_path)
 
 
+def get_demo_store_path(path):
+    """The directory of the demo store corresponding to a pickle demos path."""
+    return path[:-len('.pkl')] if path.endswith('.pkl') else path
+
+
 def load_demos(path, raise_not_found=True):
+    # Demos converted to the columnar format are read lazily, unless
+    # the pickle file has been written again since the conversion
+    meta_path = os.path.join(get_demo_store_path(path), DemoStore.META_FILE)
+    if os.path.isfile(meta_path) and (not os.path.isfile(path)
+                                      or os.path.getmtime(path) <= os.path.getmtime(meta_path)):
+        return DemoStore(os.path.dirname(meta_path))
     try:
         return pickle.load(open(path, "rb"))
     except FileNotFoundError:
@@ -28,6 +42,13 @@ def save_demos(demos, path):
     pickle.dump(demos, open(path, "wb"))
 
 
+def num_frames(demos):
+    """The total number of frames of a list of demos or of a `DemoStore`."""
+    if isinstance(demos, DemoStore):
+        return demos.num_frames()
+    return sum([len(demo[3]) for demo in demos])
+
+
 def synthesize_demos(demos):
     print('{} demonstrations saved'.format(len(demos)))
     num_frames_per_episode = [len(demo[2]) for demo in demos]
@@ -39,6 +60,7 @@ def transform_demos(demos):
     '''
     takes as input a list of demonstrations in the format generated with `make_agent_demos` or `make_human_demos`
     i.e. each demo is a tuple (mission, blosc.pack_array(np.array(images)), directions, actions)
+    or demos read from a `DemoStore`, whose images, directions and actions are arrays
     returns demos as a list of lists. Each demo is a list of (obs, action, done) tuples
     '''
     new_demos = []
@@ -50,7 +72,12 @@ def transform_demos(demos):
         directions = demo[2]
         actions = demo[3]
 
-        all_images = blosc.unpack_array(all_images)
+        if isinstance(all_images, numpy.ndarray):
+            all_images = numpy.asarray(all_images)
+            directions = directions.tolist()
+            actions = actions.tolist()
+        else:
+            all_images = blosc.unpack_array(all_images)
         n_observations = all_images.shape[0]
         assert len(directions) == len(actions) == n_observations, "error transforming demos"
         for i in range(n_observations):
@@ -62,3 +89,190 @@ def transform_demos(demos):
             new_demo.append((obs, action, done))
         new_demos.append(new_demo)
     return new_demos
+
+
+class DemoStore:
+    """
+    Demonstrations stored in flat, memory-mapped arrays
+
+    The frames of all the demos are concatenated in the images, directions
+    and actions arrays, and `offsets[k]:offsets[k + 1]` are the frames of
+    the k-th demo. The missions are deduplicated in a table indexed by the
+    per-demo mission ids. Only the demos counted in the metadata file are
+    read, the files may contain more data that was never committed.
+
+    Indexing a store with an integer returns the same
+    (mission, images, directions, actions) tuple as the pickle format,
+    except that the images are an array instead of being blosc-packed.
+    Nothing is read from the disk until the arrays are used. Indexing with
+    a slice or an array of indices returns a view of the store.
+    """
+
+    META_FILE = 'meta.json'
+
+    def __init__(self, path, indices=None):
+        self.path = path
+        with open(os.path.join(path, self.META_FILE)) as src:
+            self.meta = json.load(src)
+        with open(os.path.join(path, 'missions.txt')) as src:
+            self.missions = [json.loads(src.readline()) for _ in range(self.meta['num_missions'])]
+
+        num_episodes = self.meta['num_episodes']
+        num_frames = self.meta['num_frames']
+        self.offsets = self._memmap('offsets', numpy.int64, (num_episodes + 1,))
+        self.mission_ids = self._memmap('mission_ids', numpy.int32, (num_episodes,))
+        self.images = self._memmap('images', numpy.uint8, (num_frames,) + tuple(self.meta['image_shape']))
+        self.directions = self._memmap('directions', numpy.uint8, (num_frames,))
+        self.actions = self._memmap('actions', numpy.uint8, (num_frames,))
+
+        self.indices = numpy.arange(num_episodes) if indices is None else indices
+
+    def _memmap(self, name, dtype, shape):
+        # numpy.memmap can't map empty files
+        if numpy.prod(shape) == 0:
+            return numpy.zeros(shape, dtype=dtype)
+        return numpy.memmap(os.path.join(self.path, name + '.bin'), dtype=dtype, mode='r', shape=shape)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, index):
+        if isinstance(index, (slice, list, numpy.ndarray)):
+            view = DemoStore.__new__(DemoStore)
+            view.__dict__.update(self.__dict__)
+            view.indices = self.indices[index]
+            return view
+
+        episode = self.indices[index]
+        start, end = self.offsets[episode], self.offsets[episode + 1]
+        return (self.missions[self.mission_ids[episode]],
+                self.images[start:end],
+                self.directions[start:end],
+                self.actions[start:end])
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def num_frames(self):
+        return int(numpy.sum(self.offsets[self.indices + 1] - self.offsets[self.indices]))
+
+
+class DemoStoreWriter:
+    """
+    Appends demos, given in the pickle format, to a `DemoStore`
+
+    The demos are written to the end of the files as they come, and
+    `commit` makes them part of the store: the files are flushed to the
+    disk, then the metadata file is atomically replaced. If the writing
+    is interrupted, the store keeps the demos of the last commit, and a
+    writer created with `resume=True` truncates the files back to that
+    point and carries on from there. Extra information, such as the seed
+    to resume from, can be stored with each commit in `info`.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+        meta_path = os.path.join(path, DemoStore.META_FILE)
+        if resume and os.path.isfile(meta_path):
+            with open(meta_path) as src:
+                meta = json.load(src)
+        else:
+            meta = {'num_episodes': 0, 'num_frames': 0, 'image_shape': None,
+                    'num_missions': 0, 'missions_size': 0, 'info': {}}
+            if os.path.isfile(meta_path):
+                os.remove(meta_path)
+
+        self.num_episodes = meta['num_episodes']
+        self.num_frames = meta['num_frames']
+        self.image_shape = meta['image_shape']
+        self.info = meta['info']
+        self.missions_size = meta['missions_size']
+
+        # Drop whatever was written after the last commit
+        frame_size = int(numpy.prod(self.image_shape)) if self.image_shape else 0
+        sizes = {'images': self.num_frames * frame_size,
+                 'directions': self.num_frames,
+                 'actions': self.num_frames,
+                 'mission_ids': self.num_episodes * 4,
+                 'offsets': (self.num_episodes + 1) * 8 if self.num_episodes else 0,
+                 'missions': meta['missions_size']}
+        self.files = {}
+        for name, size in sizes.items():
+            file_path = os.path.join(path, name + ('.txt' if name == 'missions' else '.bin'))
+            self.files[name] = open(file_path, 'ab')
+            self.files[name].truncate(size)
+
+        with open(os.path.join(path, 'missions.txt')) as src:
+            missions = [json.loads(src.readline()) for _ in range(meta['num_missions'])]
+        self.mission_ids = {mission: i for i, mission in enumerate(missions)}
+
+        if self.num_episodes == 0:
+            self._write('offsets', [0], numpy.int64)
+
+    def _write(self, name, array, dtype):
+        self.files[name].write(numpy.ascontiguousarray(array, dtype=dtype).tobytes())
+
+    def append(self, demo):
+        mission, images, directions, actions = demo
+        if not isinstance(images, numpy.ndarray):
+            images = blosc.unpack_array(images)
+        assert len(images) == len(directions) == len(actions), "error writing demos"
+
+        if self.image_shape is None:
+            self.image_shape = list(images.shape[1:])
+        if mission not in self.mission_ids:
+            self.mission_ids[mission] = len(self.mission_ids)
+            line = (json.dumps(mission) + '\n').encode()
+            self.files['missions'].write(line)
+            self.missions_size += len(line)
+
+        self._write('images', images, numpy.uint8)
+        self._write('directions', directions, numpy.uint8)
+        self._write('actions', actions, numpy.uint8)
+        self._write('mission_ids', [self.mission_ids[mission]], numpy.int32)
+        self.num_frames += len(actions)
+        self.num_episodes += 1
+        self._write('offsets', [self.num_frames], numpy.int64)
+
+    def commit(self, **info):
+        for file in self.files.values():
+            file.flush()
+            os.fsync(file.fileno())
+
+        self.info.update(info)
+        meta = {'num_episodes': self.num_episodes,
+                'num_frames': self.num_frames,
+                'image_shape': self.image_shape or [],
+                'num_missions': len(self.mission_ids),
+                'missions_size': self.missions_size,
+                'info': self.info}
+
+        # The metadata file is replaced at once, so it always describes a complete store
+        meta_path = os.path.join(self.path, DemoStore.META_FILE)
+        with open(meta_path + '.tmp', 'w') as dst:
+            json.dump(meta, dst)
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def close(self, **info):
+        self.commit(**info)
+        for file in self.files.values():
+            file.close()
+
+
+def convert_demos(path, store_path=None):
+    """
+    Converts the pickled demos at `path` to a `DemoStore`, by default in the
+    directory with the same name without the .pkl extension
+    """
+
+    store_path = store_path or get_demo_store_path(path)
+    writer = DemoStoreWriter(store_path)
+    for demo in pickle.load(open(path, "rb")):
+        writer.append(demo)
+    writer.close()
+    return DemoStore(store_path)
@@ -2,7 +2,9 @@ import os
 import json
 import numpy
 import re
+import threading
 import torch
+from collections import OrderedDict
 import babyai.rl
 
 from .. import utils
@@ -21,29 +23,38 @@ class Vocabulary:
                 self.vocab = json.load(f)
         else:
             self.vocab = {}
+        # Incremented when existing tokens may get a different id
+        self.version = 0
+        # The vocabulary may be used by the thread collecting experiences
+        # in the actor/learner mode, while the main thread saves it
+        self.lock = threading.RLock()
 
     def __getitem__(self, token):
-        if not (token in self.vocab.keys()):
-            if len(self.vocab) >= self.max_size:
-                raise ValueError("Maximum vocabulary capacity reached")
-            self.vocab[token] = len(self.vocab) + 1
-        return self.vocab[token]
+        with self.lock:
+            if not (token in self.vocab.keys()):
+                if len(self.vocab) >= self.max_size:
+                    raise ValueError("Maximum vocabulary capacity reached")
+                self.vocab[token] = len(self.vocab) + 1
+            return self.vocab[token]
 
     def save(self, path=None):
         if path is None:
             path = self.path
         utils.create_folders_if_necessary(path)
-        json.dump(self.vocab, open(path, "w"))
+        with self.lock:
+            json.dump(self.vocab, open(path, "w"))
 
     def copy_vocab_from(self, other):
         '''
         Copy the vocabulary of another Vocabulary object to the current object.
         '''
-        self.vocab.update(other.vocab)
+        with self.lock:
+            self.vocab.update(other.vocab)
+            self.version += 1
 
 
 class InstructionsPreprocessor(object):
-    def __init__(self, model_name, load_vocab_from=None):
+    def __init__(self, model_name, load_vocab_from=None, cache_size=10000):
         self.model_name = model_name
         if load_vocab_from is not None and os.path.exists(load_vocab_from):
             # self.vocab.vocab should be an empty dict
@@ -52,24 +63,48 @@ class InstructionsPreprocessor(object):
         else:
             self.vocab = Vocabulary(get_vocab_path(model_name))
 
+        # LRU cache from mission strings to token ids
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.cache_version = self.vocab.version
+
+    def tokenize(self, mission):
+        # The cache and the vocabulary are shared between threads
+        with self.vocab.lock:
+            if self.cache_version != self.vocab.version:
+                self.cache.clear()
+                self.cache_version = self.vocab.version
+
+            instr = self.cache.get(mission)
+            if instr is None:
+                tokens = re.findall("([a-z]+)", mission.lower())
+                instr = torch.tensor([self.vocab[token] for token in tokens], dtype=torch.long)
+                self.cache[mission] = instr
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+            else:
+                self.cache.move_to_end(mission)
+            return instr
 
     def __call__(self, obss, device=None):
-        raw_instrs = []
-        max_instr_len = 0
-
-        for obs in obss:
-            tokens = re.findall("([a-z]+)", obs["mission"].lower())
-            instr = numpy.array([self.vocab[token] for token in tokens])
-            raw_instrs.append(instr)
-            max_instr_len = max(len(instr), max_instr_len)
-
-        instrs = numpy.zeros((len(obss), max_instr_len))
-
+        # The missions of a batch are mostly the same, so each distinct mission
+        # is only tokenized once, in order of first appearance
+        missions = [obs["mission"] for obs in obss]
+        unique_ids = {}
+        for mission in missions:
+            unique_ids.setdefault(mission, len(unique_ids))
+        raw_instrs = [self.tokenize(mission) for mission in unique_ids]
+        max_instr_len = max([len(instr) for instr in raw_instrs], default=0)
+
+        unique_instrs = torch.zeros((len(raw_instrs), max_instr_len), dtype=torch.long)
         for i, instr in enumerate(raw_instrs):
-            instrs[i, :len(instr)] = instr
+            unique_instrs[i, :len(instr)] = instr
 
-        instrs = torch.tensor(instrs, device=device, dtype=torch.long)
-        return instrs
+        if len(raw_instrs) == len(missions):
+            instrs = unique_instrs
+        else:
+            instrs = unique_instrs[torch.tensor([unique_ids[mission] for mission in missions], dtype=torch.long)]
+        return instrs.to(device)
 
 
 class RawImagePreprocessor(object):
@@ -7,8 +7,17 @@ Note: there are other automated tests in .circleci/config.yml
 
 import babyai
 from babyai import levels
+from tests import test_batch_env, test_batch_bot, test_catalog, test_demo_store, test_obj_sampling
 
 # NOTE: please make sure that tests are always deterministic
 
+# The tests of the tests/ directory can also be run with pytest
+for module in [test_batch_env, test_batch_bot, test_catalog, test_demo_store, test_obj_sampling]:
+    print('Running {}'.format(module.__name__))
+    for name in sorted(dir(module)):
+        if name.startswith('test_'):
+            print('  {}'.format(name))
+            getattr(module, name)()
+
 print('Testing levels, mission generation')
 levels.test()
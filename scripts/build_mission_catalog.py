@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+"""
+Build the catalog of the missions generated by levels for a range of seeds.
+
+The catalog is an SQLite database with one row per (level, seed), which
+records the mission, the shape of the instruction tree, the time step limit,
+the number of objects and doors, and the generation time. It can be used to
+select seeds by mission type or generation cost without generating them:
+
+    from babyai.levels.catalog import MissionCatalog
+    catalog = MissionCatalog('mission_catalog.db')
+    seeds = catalog.seeds('BossLevel', instr_shape='Before(PutNext, GoTo)')
+
+Running the script again with more seeds only generates the new ones.
+The missions depend on the generation mode, i.e. BABYAI_INSTR_RETRIES and
+--sample-valid-descs, which is recorded in the catalog: a catalog can only
+be extended in the mode it was built in.
+"""
+
+import argparse
+import logging
+import os
+import time
+
+import babyai.utils as utils
+from babyai.levels import level_dict
+from babyai.levels.catalog import build_catalog
+
+
+parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("--levels", nargs='+', default=None,
+                    help="levels to catalog (all the levels but the Test levels by default)")
+parser.add_argument("--seed", type=int, default=0,
+                    help="first seed")
+parser.add_argument("--num-seeds", type=int, default=1000,
+                    help="number of seeds per level")
+parser.add_argument("--catalog", default=None,
+                    help="path of the catalog (mission_catalog.db in the storage directory by default)")
+parser.add_argument("--workers", type=int, default=None,
+                    help="number of processes (the number of CPUs by default)")
+parser.add_argument("--timeout", type=float, default=10,
+                    help="time limit of the generation of a mission, in seconds")
+parser.add_argument("--sample-valid-descs", action="store_true", default=False,
+                    help="draw the object descriptors with a single draw (see LevelGen.rand_valid_obj)")
+args = parser.parse_args()
+
+logging.basicConfig(level='INFO', format="%(asctime)s: %(levelname)s: %(message)s")
+logger = logging.getLogger(__name__)
+
+catalog_path = args.catalog or os.path.join(utils.storage_dir(), 'mission_catalog.db')
+# The Test levels are for debugging the bot, and some of them get stuck on some seeds
+level_names = args.levels or [level_name for level_name in level_dict if not level_name.startswith('Test')]
+for level_name in level_names:
+    if level_name not in level_dict:
+        raise ValueError("unknown level: {}".format(level_name))
+
+start_time = time.time()
+catalog = build_catalog(catalog_path, level_names,
+                        range(args.seed, args.seed + args.num_seeds), args.workers,
+                        sample_valid_descs=args.sample_valid_descs, timeout=args.timeout)
+logger.info("catalog built in {:.1f} seconds".format(time.time() - start_time))
+
+for level_name, num_seeds, num_errors, num_shapes, mean_gen_time in catalog.db.execute(
+        'SELECT level, COUNT(*), COUNT(error), COUNT(DISTINCT instr_shape), AVG(gen_time) '
+        'FROM missions GROUP BY level ORDER BY level'):
+    if level_name in level_names:
+        logger.info("{}: {} seeds, {} errors, {} instruction shapes, {:.2f}ms per mission".format(
+            level_name, num_seeds, num_errors, num_shapes, 1000 * mean_gen_time))
+catalog.close()
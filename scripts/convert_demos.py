@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+
+"""
+Convert pickled demonstrations to the columnar, memory-mapped demo store.
+The store is written next to the pickle file, in a directory with the same
+name without the .pkl extension, and is then used by `load_demos`.
+"""
+
+import argparse
+
+import babyai.utils as utils
+
+
+parser = argparse.ArgumentParser("Convert demonstrations to a demo store")
+parser.add_argument("--demos", default=None,
+                    help="demos filename (REQUIRED or demos-origin required)")
+parser.add_argument("--env", default=None,
+                    help="name of the environment the demos were generated on")
+parser.add_argument("--demos-origin", required=False,
+                    help="origin of the demonstrations: human | agent (REQUIRED or demos required)")
+parser.add_argument("--valid", action="store_true", default=False,
+                    help="convert the validation demos")
+args = parser.parse_args()
+
+demos_path = utils.get_demos_path(args.demos, args.env, args.demos_origin, valid=args.valid)
+store = utils.demos.convert_demos(demos_path)
+print('{} demos ({} frames) converted to {}'.format(len(store), store.num_frames(), store.path))
@@ -8,6 +8,12 @@ The agent can either be a trained model or the heuristic expert (bot).
 Demonstration generation can take a long time, but it can be parallelized
 if you have a cluster at your disposal. Provide a script that launches
 make_agent_demos.py at your cluster as --job-script and the number of jobs as --jobs.
+On a single machine, --workers runs the rollouts in a pool of processes. Every
+demo only depends on its seed, so the output is the same as a sequential run.
+
+The demonstrations are streamed to a demo store, and committed every
+--save-interval demos. An interrupted generation can be continued from the
+last committed demo with --resume.
 
 
 """
@@ -15,12 +21,14 @@ make_agent_demos.py at your cluster as --job-script and the number of jobs as --
 import argparse
 import gym
 import logging
+import multiprocessing
 import sys
 import subprocess
 import os
+import shutil
 import time
+from collections import deque
 import numpy as np
-import blosc
 import torch
 
 import babyai.utils as utils
@@ -46,6 +54,8 @@ parser.add_argument("--log-interval", type=int, default=100,
                     help="interval between progress reports")
 parser.add_argument("--save-interval", type=int, default=10000,
                     help="interval between demonstrations saving")
+parser.add_argument("--resume", action="store_true", default=False,
+                    help="continue an interrupted generation from the last saved demonstration")
 parser.add_argument("--filter-steps", type=int, default=0,
                     help="filter out demos with number of steps more than filter-steps")
 parser.add_argument("--on-exception", type=str, default='warn', choices=('warn', 'crash'),
@@ -55,6 +65,8 @@ parser.add_argument("--job-script", type=str, default=None,
                     help="The script that launches make_agent_demos.py at a cluster.")
 parser.add_argument("--jobs", type=int, default=0,
                     help="Split generation in that many jobs")
+parser.add_argument("--workers", type=int, default=0,
+                    help="generate the demos in that many local processes")
 
 args = parser.parse_args()
 logger = logging.getLogger(__name__)
@@ -62,36 +74,25 @@ logger = logging.getLogger(__name__)
 # Set seed for all randomness sources
 
 
-def print_demo_lengths(demos):
-    num_frames_per_episode = [len(demo[2]) for demo in demos]
+def print_demo_lengths(num_frames_per_episode):
     logger.info('Demo length: {:.3f}+-{:.3f}'.format(
         np.mean(num_frames_per_episode), np.std(num_frames_per_episode)))
 
 
-def generate_demos(n_episodes, valid, seed, shift=0):
-    utils.seed(seed)
-
-    # Generate environment
-    env = gym.make(args.env)
+def generate_episode(env, agent, seed):
+    """
+    Generate the demo for one seed. If the agent fails, the environment is
+    reset without reseeding until it finds a mission that the agent can
+    solve, so the demo only depends on the seed.
+    """
 
-    agent = utils.load_agent(env, args.model, args.demos, 'agent', args.argmax, args.env)
-    demos_path = utils.get_demos_path(args.demos, args.env, 'agent', valid)
-    demos = []
-
-    checkpoint_time = time.time()
-
-    just_crashed = False
+    # The random sources of a sampling agent are reseeded too, so that a
+    # worker gives the same demo as a sequential run
+    utils.seed(seed)
+    env.seed(seed)
     while True:
-        if len(demos) == n_episodes:
-            break
-
         done = False
-        if just_crashed:
-            logger.info("reset the environment to find a mission that the bot can solve")
-            env.reset()
-        else:
-            env.seed(seed + len(demos))
-        obs = env.reset()
+        obs, _ = env.reset()
         agent.on_reset()
 
         actions = []
@@ -113,44 +114,90 @@ def generate_demos(n_episodes, valid, seed, shift=0):
 
                 obs = new_obs
             if reward > 0 and (args.filter_steps == 0 or len(images) <= args.filter_steps):
-                demos.append((mission, blosc.pack_array(np.array(images)), directions, actions))
-                just_crashed = False
+                return (mission, np.array(images), directions, actions)
 
             if reward == 0:
                 if args.on_exception == 'crash':
-                    raise Exception("mission failed, the seed is {}".format(seed + len(demos)))
-                just_crashed = True
+                    raise Exception("mission failed, the seed is {}".format(seed))
                 logger.info("mission failed")
         except (Exception, AssertionError):
             if args.on_exception == 'crash':
                 raise
-            just_crashed = True
-            logger.exception("error while generating demo #{}".format(len(demos)))
-            continue
+            logger.exception("error while generating the demo for seed {}".format(seed))
+
+        logger.info("reset the environment to find a mission that the bot can solve")
+
+
+def init_worker():
+    global worker_env, worker_agent
+    worker_env = gym.make(args.env)
+    worker_agent = utils.load_agent(worker_env, args.model, args.demos, 'agent', args.argmax, args.env)
+
+
+def generate_worker_episode(seed):
+    return generate_episode(worker_env, worker_agent, seed)
+
+
+def generate_demos(n_episodes, valid, seed, shift=0):
+    utils.seed(seed)
+
+    demos_path = utils.get_demos_path(args.demos, args.env, 'agent', valid)
+    writer = utils.demos.DemoStoreWriter(utils.demos.get_demo_store_path(demos_path), resume=args.resume)
+    if writer.num_episodes:
+        if writer.info.get('seed') != seed:
+            raise ValueError("the demos to resume were generated from seed {}".format(writer.info.get('seed')))
+        logger.info("Resuming after {} demos".format(writer.num_episodes))
+    demo_seeds = range(seed + writer.num_episodes, seed + n_episodes)
+
+    if args.workers > 0:
+        # Every task is a contiguous range of seeds, and the demos come back in order
+        pool = multiprocessing.Pool(args.workers, initializer=init_worker)
+        chunksize = max(1, min(64, len(demo_seeds) // (4 * args.workers)))
+        demos = pool.imap(generate_worker_episode, demo_seeds, chunksize)
+    else:
+        # Generate environment
+        env = gym.make(args.env)
+
+        agent = utils.load_agent(env, args.model, args.demos, 'agent', args.argmax, args.env)
+        demos = (generate_episode(env, agent, demo_seed) for demo_seed in demo_seeds)
+
+    num_demos = writer.num_episodes
+    demo_lengths = deque(maxlen=100)
+
+    checkpoint_time = time.time()
+
+    for demo in demos:
+        writer.append(demo)
+        num_demos += 1
+        demo_lengths.append(len(demo[2]))
 
-        if len(demos) and len(demos) % args.log_interval == 0:
+        if num_demos % args.log_interval == 0:
             now = time.time()
             demos_per_second = args.log_interval / (now - checkpoint_time)
-            to_go = (n_episodes - len(demos)) / demos_per_second
+            to_go = (n_episodes - num_demos) / demos_per_second
             logger.info("demo #{}, {:.3f} demos per second, {:.3f} seconds to go".format(
-                len(demos) - 1, demos_per_second, to_go))
+                num_demos - 1, demos_per_second, to_go))
             checkpoint_time = now
 
         # Save demonstrations
+        # Only the demos generated since the last save are written
 
-        if args.save_interval > 0 and len(demos) < n_episodes and len(demos) % args.save_interval == 0:
+        if args.save_interval > 0 and num_demos < n_episodes and num_demos % args.save_interval == 0:
             logger.info("Saving demos...")
-            utils.save_demos(demos, demos_path)
-            logger.info("{} demos saved".format(len(demos)))
+            writer.commit(seed=seed)
+            logger.info("{} demos saved".format(num_demos))
             # print statistics for the last 100 demonstrations
-            print_demo_lengths(demos[-100:])
+            print_demo_lengths(demo_lengths)
 
+    if args.workers > 0:
+        pool.close()
+        pool.join()
 
     # Save demonstrations
     logger.info("Saving demos...")
-    utils.save_demos(demos, demos_path)
-    logger.info("{} demos saved".format(len(demos)))
-    print_demo_lengths(demos[-100:])
+    writer.close(seed=seed)
+    logger.info("{} demos saved".format(num_demos))
+    print_demo_lengths(demo_lengths)
 
 
 def generate_demos_cluster():
@@ -162,6 +209,9 @@ def generate_demos_cluster():
         job_demos_path = utils.get_demos_path(demo_name)
         if os.path.exists(job_demos_path):
             os.remove(job_demos_path)
+        job_store_path = utils.demos.get_demo_store_path(job_demos_path)
+        if os.path.exists(job_store_path):
+            shutil.rmtree(job_store_path)
 
     command = [args.job_script]
     command += sys.argv[1:]
@@ -200,10 +250,11 @@ def generate_demos_cluster():
         time.sleep(60)
 
     # Training demos
-    all_demos = []
+    writer = utils.demos.DemoStoreWriter(utils.demos.get_demo_store_path(demos_path))
     for demos in job_demos:
-        all_demos.extend(demos)
-    utils.save_demos(all_demos, demos_path)
+        for demo in demos:
+            writer.append(demo)
+    writer.close(seed=args.seed)
 
 
 logging.basicConfig(level='INFO', format="%(asctime)s: %(levelname)s: %(message)s")
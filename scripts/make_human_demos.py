@@ -16,7 +16,7 @@ from PyQt5.QtWidgets import QLabel, QTextEdit, QFrame
 from PyQt5.QtWidgets import QPushButton, QHBoxLayout, QVBoxLayout
 
 import babyai.utils as utils
-import blosc
+from babyai.utils.demos import DemoStore, DemoStoreWriter, get_demo_store_path, convert_demos
 
 # Parse arguments
 parser = argparse.ArgumentParser()
@@ -53,13 +53,19 @@ class AIGameWindow(QMainWindow):
         self.env = env
         self.lastObs = None
 
-        # Demonstrations
+        # Demonstrations, which are appended to a demo store as they are made
         self.demos_path = utils.get_demos_path(args.demos, args.env, origin="human", valid=False)
-        self.demos = utils.load_demos(self.demos_path, raise_not_found=False)
-        utils.synthesize_demos(self.demos)
-
-
-        self.shift = len(self.demos) if args.shift is None else args.shift
+        demos = utils.load_demos(self.demos_path, raise_not_found=False)
+        if len(demos) > 0 and not isinstance(demos, DemoStore):
+            # Demos that were only pickled are converted to a store first
+            convert_demos(self.demos_path)
+        self.store_path = get_demo_store_path(self.demos_path)
+        self.writer = DemoStoreWriter(self.store_path, resume=True)
+        self.writer.commit()
+        self.num_demos = self.writer.num_episodes
+        utils.synthesize_demos(DemoStore(self.store_path))
+
+        self.shift = self.num_demos if args.shift is None else args.shift
 
         self.shiftEnv()
 
@@ -185,7 +191,7 @@ class AIGameWindow(QMainWindow):
         QMainWindow.mousePressEvent(self, event)
 
     def shiftEnv(self):
-        assert self.shift <= len(self.demos)
+        assert self.shift <= self.num_demos
 
         self.env.seed(args.seed)
         self.resetEnv()
@@ -242,16 +248,18 @@ class AIGameWindow(QMainWindow):
 
         if done:
             if reward > 0:  # i.e. we did not lose
-                if self.shift < len(self.demos):
-                    self.demos[self.shift] = self.current_demo, self.shift
+                if self.shift < self.num_demos:
+                    # The store is append-only, the existing demo is kept
+                    self.missionBox.append('There is already a demonstration for this mission.')
                 else:
-                    self.demos.append((self.current_mission,
-                                       blosc.pack_array(np.array(self.current_images)),
-                                       self.current_directions,
-                                       self.current_actions))
-                utils.save_demos(self.demos, self.demos_path)
-                self.missionBox.append('Demonstrations are saved.')
-                utils.synthesize_demos(self.demos)
+                    self.writer.append((self.current_mission,
+                                        np.array(self.current_images),
+                                        self.current_directions,
+                                        self.current_actions))
+                    self.writer.commit()
+                    self.num_demos += 1
+                    self.missionBox.append('Demonstrations are saved.')
+                    utils.synthesize_demos(DemoStore(self.store_path))
 
                 self.shift += 1
                 self.resetEnv()
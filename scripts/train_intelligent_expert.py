@@ -247,6 +247,8 @@ def main(args):
             logger.info("Reached target success rate with {} demos, stopping".format(len(il_learn.train_demos)))
             break
 
+        # The demos may have been read from a demo store, which can't be extended
+        il_learn.train_demos = list(il_learn.train_demos)
         eval_seed = grow_training_set(
             il_learn,
             il_learn.train_demos,
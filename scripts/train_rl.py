@@ -8,7 +8,6 @@ import os
 import logging
 import csv
 import json
-import gym
 import time
 import datetime
 import torch
@@ -20,7 +19,9 @@ import babyai.utils as utils
 import babyai.rl
 from babyai.arguments import ArgumentParser
 from babyai.model import ACModel
+from babyai.rl.utils import EnvFactory, ParallelEnv
 from babyai.evaluate import batch_evaluate
+from babyai.levels.snapshot_cache import SnapshotCache
 from babyai.utils.agent import ModelAgent
 
 
@@ -42,16 +43,25 @@ parser.add_argument("--clip-eps", type=float, default=0.2,
                     help="clipping epsilon for PPO (default: 0.2)")
 parser.add_argument("--ppo-epochs", type=int, default=4,
                     help="number of epochs for PPO (default: 4)")
+parser.add_argument("--shared-memory", action="store_true", default=False,
+                    help="send observations from the environment processes through shared memory")
+parser.add_argument("--envs-per-worker", type=int, default=1,
+                    help="number of environments stepped by each process (default: 1)")
+parser.add_argument("--reset-ahead", action="store_true", default=False,
+                    help="generate the next episode of the environments while the model is busy")
+parser.add_argument("--actor-learner", action="store_true", default=False,
+                    help="collect the next rollout with the previous weights while the model is updated")
+parser.add_argument("--pipelined", action="store_true", default=False,
+                    help="compute the actions of half of the environments while the other half is stepped")
 args = parser.parse_args()
 
 utils.seed(args.seed)
 
-# Generate environments
-envs = []
-for i in range(args.procs):
-    env = gym.make(args.env)
-    env.seed(100 * args.seed + i)
-    envs.append(env)
+# Generate environments, each worker process builds its own
+envs = [EnvFactory(args.env, 100 * args.seed + i) for i in range(args.procs)]
+penv = ParallelEnv(envs, shared_memory=args.shared_memory,
+                   envs_per_worker=args.envs_per_worker,
+                   reset_ahead=args.reset_ahead)
 
 # Define model name
 suffix = datetime.datetime.now().strftime("%y-%m-%d-%H-%M-%S")
@@ -77,9 +87,9 @@ logger = logging.getLogger(__name__)
 
 # Define obss preprocessor
 if 'emb' in args.arch:
-    obss_preprocessor = utils.IntObssPreprocessor(args.model, envs[0].observation_space, args.pretrained_model)
+    obss_preprocessor = utils.IntObssPreprocessor(args.model, penv.observation_space, args.pretrained_model)
 else:
-    obss_preprocessor = utils.ObssPreprocessor(args.model, envs[0].observation_space, args.pretrained_model)
+    obss_preprocessor = utils.ObssPreprocessor(args.model, penv.observation_space, args.pretrained_model)
 
 # Define actor-critic model
 acmodel = utils.load_model(args.model, raise_not_found=False)
@@ -87,7 +97,7 @@ if acmodel is None:
     if args.pretrained_model:
         acmodel = utils.load_model(args.pretrained_model, raise_not_found=True)
     else:
-        acmodel = ACModel(obss_preprocessor.obs_space, envs[0].action_space,
+        acmodel = ACModel(obss_preprocessor.obs_space, penv.action_space,
                           args.image_dim, args.memory_dim, args.instr_dim,
                           not args.no_instr, args.instr_arch, not args.no_mem, args.arch)
 
@@ -101,11 +111,12 @@ if torch.cuda.is_available():
 
 reshape_reward = lambda _0, _1, reward, _2: args.reward_scale * reward
 if args.algo == "ppo":
-    algo = babyai.rl.PPOAlgo(envs, acmodel, args.frames_per_proc, args.discount, args.lr, args.beta1, args.beta2,
+    algo = babyai.rl.PPOAlgo(penv, acmodel, args.frames_per_proc, args.discount, args.lr, args.beta1, args.beta2,
                              args.gae_lambda,
                              args.entropy_coef, args.value_loss_coef, args.max_grad_norm, args.recurrence,
                              args.optim_eps, args.clip_eps, args.ppo_epochs, args.batch_size, obss_preprocessor,
-                             reshape_reward)
+                             reshape_reward, pipelined=args.pipelined,
+                             actor_learner=args.actor_learner)
 else:
     raise ValueError("Incorrect algorithm name: {}".format(args.algo))
 
@@ -132,7 +143,8 @@ header = (["update", "episodes", "frames", "FPS", "duration"]
           + ["return_" + stat for stat in ['mean', 'std', 'min', 'max']]
           + ["success_rate"]
           + ["num_frames_" + stat for stat in ['mean', 'std', 'min', 'max']]
-          + ["entropy", "value", "policy_loss", "value_loss", "loss", "grad_norm"])
+          + ["entropy", "value", "policy_loss", "value_loss", "loss", "grad_norm"]
+          + (["policy_lag"] if args.actor_learner else []))
 if args.tb:
     from tensorboardX import SummaryWriter
 
@@ -173,6 +185,8 @@ logger.info(acmodel)
 total_start_time = time.time()
 best_success_rate = 0
 test_env_name = args.env
+# The validation episodes always use the same seeds
+val_snapshot_cache = SnapshotCache()
 while status['num_frames'] < args.frames:
     # Update parameters
 
@@ -206,6 +220,9 @@ while status['num_frames'] < args.frames:
         format_str = ("U {} | E {} | F {:06} | FPS {:04.0f} | D {} | R:xsmM {: .2f} {: .2f} {: .2f} {: .2f} | "
                       "S {:.2f} | F:xsmM {:.1f} {:.1f} {} {} | H {:.3f} | V {:.3f} | "
                       "pL {: .3f} | vL {:.3f} | L {:.3f} | gN {:.3f} | ")
+        if args.actor_learner:
+            data.append(logs["policy_lag"])
+            format_str += "lag {} | "
 
         logger.info(format_str.format(*data))
         if args.tb:
@@ -227,7 +244,8 @@ while status['num_frames'] < args.frames:
         agent = ModelAgent(args.model, obss_preprocessor, argmax=True)
         agent.model = acmodel
         agent.model.eval()
-        logs = batch_evaluate(agent, test_env_name, args.val_seed, args.val_episodes)
+        logs = batch_evaluate(agent, test_env_name, args.val_seed, args.val_episodes,
+                              snapshot_cache=val_snapshot_cache)
         agent.model.train()
         mean_return = np.mean(logs["return_per_episode"])
         success_rate = np.mean([1 if r > 0 else 0 for r in logs['return_per_episode']])
@@ -0,0 +1,88 @@
+"""
+Check that the bots running next to the environments of a `ParallelEnv`
+suggest the same actions as bots run one environment after another.
+"""
+
+import gym
+from gym_minigrid.minigrid import MiniGridEnv
+
+import babyai
+from babyai.bot import Bot
+from babyai.rl.utils import EnvFactory, ParallelEnv
+from babyai.rl.utils.penv import EnvBots
+from babyai.utils import BatchBotAgent
+
+
+ENV_NAME = 'BabyAI-BossLevel-v0'
+
+
+def serial_bot_actions(seed, num_steps):
+    env = gym.make(ENV_NAME)
+    env.seed(seed)
+    env.reset()
+    bot = Bot(env)
+    action = None
+    actions = []
+    for t in range(num_steps):
+        action = bot.replan(action)
+        actions.append(int(action))
+        _, _, done, _ = env.step(action)
+        if done:
+            env.reset()
+            bot = Bot(env)
+            action = None
+    return actions
+
+
+def test_batch_bot_agent_matches_bots(num_envs=4, num_steps=100):
+    expected_actions = [serial_bot_actions(100 + k, num_steps) for k in range(num_envs)]
+    for kwargs in [dict(), dict(shared_memory=True), dict(envs_per_worker=2, reset_ahead=True)]:
+        penv = ParallelEnv([EnvFactory(ENV_NAME, 100 + k) for k in range(num_envs)], bot=Bot, **kwargs)
+        agent = BatchBotAgent(penv)
+        obss, _ = penv.reset()
+        actions = [[] for _ in range(num_envs)]
+        for t in range(num_steps):
+            action = agent.act_batch(obss)['action']
+            for k in range(num_envs):
+                actions[k].append(int(action[k]))
+            obss, _, _, _ = penv.step(action.numpy())
+        assert actions == expected_actions, kwargs
+
+
+class UnsupportedBot:
+    def __init__(self, env):
+        assert False, "unknown instruction type"
+
+
+class BrokenBot:
+    def __init__(self, env):
+        pass
+
+    def replan(self, action_taken=None):
+        raise ValueError("not an expected failure")
+
+
+def test_env_bots_give_up():
+    env = gym.make(ENV_NAME)
+    env.seed(0)
+
+    bots = EnvBots([env], UnsupportedBot)
+    _, info = env.reset()
+    bots.start(0, info)
+    assert info['bot_action'] is None
+    assert bots.bots[0] is None
+
+    bots = EnvBots([env], BrokenBot)
+    try:
+        bots.start(0, info)
+    except ValueError:
+        pass
+    else:
+        assert False, "unexpected errors of the bots must not be caught"
+
+
+def test_batch_bot_agent_done_without_bot():
+    penv = ParallelEnv([EnvFactory(ENV_NAME, 0), EnvFactory(ENV_NAME, 1)], bot=UnsupportedBot)
+    obss, _ = penv.reset()
+    action = BatchBotAgent(penv).act_batch(obss)['action']
+    assert action.tolist() == [MiniGridEnv.Actions.done] * 2
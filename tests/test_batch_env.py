@@ -0,0 +1,53 @@
+"""
+Check that `BatchEnv` steps its environments like their own `step` does.
+"""
+
+import numpy as np
+
+from babyai.levels import level_dict
+from babyai.levels.batch_env import BatchEnv
+
+
+# CustomGoToObjMultiple has verifiers which move the objects around
+LEVELS = ['GoToLocal', 'PutNextLocal', 'UnlockPickup', 'BossLevel', 'CustomGoToObjMultiple']
+
+
+def check_batch_env(level_name, auto_reset, num_envs=6, num_steps=150):
+    level = level_dict[level_name]
+    envs = [level() for _ in range(num_envs)]
+    batch = BatchEnv([level() for _ in range(num_envs)], auto_reset=auto_reset)
+    for k in range(num_envs):
+        envs[k].seed(k)
+        batch.envs[k].seed(k)
+
+    for (obs, _), (batch_obs, _) in zip([env.reset() for env in envs], batch.reset()):
+        assert np.array_equal(obs['image'], batch_obs['image'])
+
+    rng = np.random.RandomState(0)
+    done = [False] * num_envs
+    for t in range(num_steps):
+        actions = rng.randint(0, 6, size=num_envs)
+        batch_obss, batch_rewards, batch_dones, batch_infos = batch.step(actions)
+        for k, env in enumerate(envs):
+            if done[k] and not auto_reset:
+                continue
+            obs, reward, done[k], info = env.step(actions[k])
+            if done[k] and auto_reset:
+                obs, _ = env.reset()
+            context = (level_name, auto_reset, t, k)
+            assert np.array_equal(obs['image'], batch_obss[k]['image']), context
+            assert obs['direction'] == batch_obss[k]['direction'], context
+            assert obs['mission'] == batch_obss[k]['mission'], context
+            assert reward == batch_rewards[k], context
+            assert done[k] == batch_dones[k], context
+            assert info == batch_infos[k], context
+
+
+def test_batch_env_matches_step():
+    for level_name in LEVELS:
+        check_batch_env(level_name, auto_reset=False)
+
+
+def test_batch_env_auto_reset_matches_step():
+    for level_name in LEVELS:
+        check_batch_env(level_name, auto_reset=True)
@@ -0,0 +1,59 @@
+"""
+Check that the mission catalog records the missions of the levels, and
+the seeds whose generation fails or gets stuck.
+"""
+
+import os
+import tempfile
+
+from babyai.levels import level_dict
+from babyai.levels.catalog import build_catalog, generation_mode
+
+
+def test_catalog_matches_levels():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'catalog.db')
+        build_catalog(path, ['GoToLocal', 'Synth'], range(5), processes=2).close()
+        catalog = build_catalog(path, ['GoToLocal', 'Synth'], range(10), processes=2)
+        for level_name in ['GoToLocal', 'Synth']:
+            assert catalog.seeds(level_name) == list(range(10))
+            for seed in range(10):
+                assert catalog.get(level_name, seed)['mission'] == level_dict[level_name](seed=seed).surface
+        catalog.close()
+
+
+def test_catalog_timeout():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'catalog.db')
+        # TestGoToBlocked gets stuck on seed 8
+        catalog = build_catalog(path, ['GoToObj', 'TestGoToBlocked'], range(10), processes=2, timeout=1)
+        assert catalog.seeds('GoToObj') == list(range(10))
+        assert catalog.seeds('TestGoToBlocked') == [seed for seed in range(10) if seed != 8]
+        assert catalog.get('TestGoToBlocked', 8)['error'] == 'timeout after 1s'
+        catalog.close()
+
+
+def test_catalog_mode():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'catalog.db')
+        catalog = build_catalog(path, ['PickupLoc'], range(5), processes=1)
+        assert catalog.mode() == generation_mode()
+        catalog.close()
+
+        try:
+            build_catalog(path, ['PickupLoc'], range(10), processes=1, sample_valid_descs=True)
+        except ValueError:
+            pass
+        else:
+            assert False, "a catalog must not be extended in another generation mode"
+
+        path = os.path.join(tmp_dir, 'valid_descs.db')
+        catalog = build_catalog(path, ['PickupLoc'], range(5), processes=1, sample_valid_descs=True)
+        assert catalog.mode() == generation_mode(sample_valid_descs=True)
+        for seed in range(5):
+            env = level_dict['PickupLoc']()
+            env.sample_valid_descs = True
+            env.seed(seed)
+            env.reset()
+            assert catalog.get('PickupLoc', seed)['mission'] == env.surface
+        catalog.close()
@@ -0,0 +1,86 @@
+"""
+Check that demos written to a `DemoStore` read back like the pickled demos.
+"""
+
+import os
+import tempfile
+
+import blosc
+import numpy as np
+
+from babyai.utils.demos import (
+    DemoStore, DemoStoreWriter, convert_demos, load_demos, save_demos)
+
+
+def make_demos(num_demos, seed=0):
+    rng = np.random.RandomState(seed)
+    demos = []
+    for k in range(num_demos):
+        length = rng.randint(1, 20)
+        images = rng.randint(0, 11, size=(length, 7, 7, 3)).astype(np.uint8)
+        mission = 'go to the {} ball'.format(['red', 'green', 'blue'][k % 3])
+        directions = list(rng.randint(0, 4, size=length))
+        actions = list(rng.randint(0, 7, size=length))
+        demos.append((mission, blosc.pack_array(images), directions, actions))
+    return demos
+
+
+def check_demos(store, demos):
+    assert len(store) == len(demos)
+    for (mission, images, directions, actions), demo in zip(store, demos):
+        assert mission == demo[0]
+        assert np.array_equal(images, blosc.unpack_array(demo[1]))
+        assert list(directions) == list(demo[2])
+        assert list(actions) == list(demo[3])
+
+
+def test_demo_store_round_trip():
+    demos = make_demos(10)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        writer = DemoStoreWriter(os.path.join(tmp_dir, 'demos'))
+        for demo in demos:
+            writer.append(demo)
+        writer.close(seed=10)
+
+        store = DemoStore(os.path.join(tmp_dir, 'demos'))
+        check_demos(store, demos)
+        check_demos(store[3:7], demos[3:7])
+        assert store.meta['info'] == {'seed': 10}
+        assert store.num_frames() == sum(len(demo[3]) for demo in demos)
+
+
+def test_demo_store_resume():
+    demos = make_demos(10)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'demos')
+        writer = DemoStoreWriter(path)
+        for demo in demos[:4]:
+            writer.append(demo)
+        writer.commit(seed=4)
+        # These demos are never committed, as if the writing was interrupted
+        for demo in make_demos(3, seed=1):
+            writer.append(demo)
+        for file in writer.files.values():
+            file.flush()
+        check_demos(DemoStore(path), demos[:4])
+
+        writer = DemoStoreWriter(path, resume=True)
+        assert writer.num_episodes == 4
+        assert writer.info == {'seed': 4}
+        for demo in demos[4:]:
+            writer.append(demo)
+        writer.close(seed=10)
+        check_demos(DemoStore(path), demos)
+
+
+def test_convert_demos():
+    demos = make_demos(5)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'demos.pkl')
+        save_demos(demos, path)
+        assert isinstance(load_demos(path), list)
+
+        check_demos(convert_demos(path), demos)
+        store = load_demos(path)
+        assert isinstance(store, DemoStore)
+        check_demos(store, demos)
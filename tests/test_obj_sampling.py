@@ -0,0 +1,81 @@
+"""
+Check the object descriptors drawn by `LevelGen.rand_obj` and by the
+single-draw sampler enabled with `sample_valid_descs`.
+"""
+
+from collections import Counter
+
+from babyai.levels import level_dict
+
+
+# Missions generated by rejection sampling, which must not change for a seed
+MISSIONS = {
+    ('Synth', 0): 'put a red key next to a yellow door',
+    ('PickupLoc', 0): 'pick up the green ball in front of you',
+    ('BossLevelNoUnlock', 2): 'pick up the key in front of you and go to the green box',
+    ('BossLevel', 1): 'pick up a box after go to the key on your right',
+    ('BossLevel', 2): 'pick up a purple key and pick up a box after put a ball next to a green door '
+                      'and go to the blue key',
+}
+
+
+def make_env(level_name, seed, sample_valid_descs=False):
+    env = level_dict[level_name]()
+    env.sample_valid_descs = sample_valid_descs
+    env.seed(seed)
+    obs, _ = env.reset()
+    return env, obs
+
+
+def check_valid(env, desc):
+    objs, poss = desc.find_matching_objs(env)
+    if not env.implicit_unlock and env.locked_room:
+        poss = [pos for pos in poss if not env.locked_room.pos_inside(*pos)]
+    assert len(poss) > 0, desc.surface(env)
+
+
+def test_default_missions_unchanged():
+    for (level_name, seed), mission in MISSIONS.items():
+        _, obs = make_env(level_name, seed)
+        assert obs['mission'] == mission, (level_name, seed)
+
+
+def test_valid_obj_descs():
+    for level_name in ['Synth', 'SynthLoc', 'BossLevel', 'BossLevelNoUnlock']:
+        for seed in range(10):
+            env, _ = make_env(level_name, seed)
+            valid_descs = set(env.valid_obj_descs())
+            for _ in range(200):
+                desc = env.rand_obj()
+                assert (desc.color, desc.type, desc.loc) in valid_descs
+            for _ in range(200):
+                check_valid(env, env.rand_valid_obj())
+
+
+def test_rand_valid_obj_distribution():
+    env, _ = make_env('BossLevel', 0)
+    num_draws = 20000
+    rejection = Counter()
+    single_draw = Counter()
+    for _ in range(num_draws):
+        desc = env.rand_obj()
+        rejection[desc.color, desc.type, desc.loc] += 1
+        desc = env.rand_valid_obj()
+        single_draw[desc.color, desc.type, desc.loc] += 1
+
+    # Total variation distance between the two empirical distributions
+    distance = sum(abs(rejection[desc] - single_draw[desc])
+                   for desc in set(rejection) | set(single_draw)) / (2 * num_draws)
+    assert distance < 0.05, distance
+
+
+def test_sample_valid_descs_missions():
+    for level_name in ['PickupLoc', 'SynthLoc', 'BossLevel']:
+        num_changed = 0
+        for seed in range(10):
+            env, obs = make_env(level_name, seed, sample_valid_descs=True)
+            assert obs['mission'] == env.surface
+            _, default_obs = make_env(level_name, seed)
+            num_changed += obs['mission'] != default_obs['mission']
+        # The missions are drawn with the other sampler
+        assert num_changed > 0, level_name